@@ -1,8 +1,18 @@
+import argparse
+import asyncio
+import os
+import signal
 import socket
 import threading
-import json
+import queue
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
 from helpers.constants import *
 from helpers.app_helpers import *
+from helpers.protocol import *
+from helpers.instrumentation import *
+from helpers import serialization
 
 dbm = DatabaseManager()
 acm = AccountManager(dbm)
@@ -11,79 +21,759 @@ dtm = DataManager(acm)
 SERVER = socket.gethostbyname(socket.gethostname())
 ADDR = (SERVER, PORT)
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.bind(ADDR)
+# Bounded pool that runs all SQLite work for the asyncio server, so the
+# event loop itself never blocks on the database.
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
 
-def start_server() -> None:
+# Applied to connections that negotiate compression; --compress-threshold/--compress-level override them
+compression_threshold = COMPRESSION_THRESHOLD
+compression_level = COMPRESSION_LEVEL
+
+class Client:
+    """
+    Per-connection state. session holds the auth state and pending order for
+    this client alone. push() sends an unsolicited frame (such as an order
+    event) to this client without waiting for a request.
+    """
+    def __init__(self, addr, send_push):
+        self.addr = addr
+        self.session = Session()
+        self.protocol = 1
+        # Payload size above which replies are compressed; None until negotiated
+        self.compress_above = None
+        self.feed_token = None
+        self._send_push = send_push
+
+    def push(self, response_obj):
+        request_id = PUSH_REQUEST_ID if self.protocol >= 2 else None
+        self._send_push(encode_response(response_obj, request_id, self.compress_above))
+
+    def feed_dropped(self, token: int):
+        """Called when the feed drops this stalled subscriber, so it can idle out or subscribe again."""
+        if self.feed_token == token:
+            self.feed_token = None
+
+    def unsubscribe(self):
+        if self.feed_token is not None:
+            dtm.unsubscribe_pending_orders(self.feed_token)
+            self.feed_token = None
+
+    def close(self):
+        self.unsubscribe()
+
+class PushQueue:
+    """
+    Delivers pushed frames for a threaded connection from its own sender
+    thread, so a slow client never blocks the thread that published the event.
+    """
+    def __init__(self, conn, send_lock):
+        self.conn = conn
+        self.send_lock = send_lock
+        self.queue = queue.Queue(maxsize=PUSH_QUEUE_SIZE)
+        self.thread = None
+        self._start_lock = threading.Lock()
+
+    def push(self, frame: bytes):
+        with self._start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.queue.put_nowait(frame)  # raises queue.Full for a client that stopped reading
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            try:
+                with self.send_lock:
+                    self.conn.sendall(frame)
+            except OSError:
+                return
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+
+class Admission:
+    """
+    Server-wide load limits. At most max_connections connections are open
+    and at most max_requests requests are queued or running at once; anything
+    over a limit is answered with BUSY_RESPONSE straight away, so overload
+    turns into quick retries instead of piling up threads. It also tracks
+    open connections so a shutdown can stop their reads and wait for them.
+    """
+    def __init__(self, max_connections: int = MAX_CONNECTIONS, max_requests: int = MAX_QUEUED_REQUESTS,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        self.max_connections = max_connections
+        self.queue_timeout = queue_timeout
+        self.draining = False
+        self._requests = threading.BoundedSemaphore(max_requests)
+        self._lock = threading.Condition()
+        self._stop_reading = {}
+
+    def open_connection(self, key, stop_reading) -> bool:
+        """Admits a connection unless the server is full or draining; stop_reading() ends its reads."""
+        with self._lock:
+            if self.draining or len(self._stop_reading) >= self.max_connections:
+                metrics.record_rejection("connections")
+                return False
+            self._stop_reading[key] = stop_reading
+            return True
+
+    def close_connection(self, key):
+        with self._lock:
+            self._stop_reading.pop(key, None)
+            self._lock.notify_all()
+
+    @property
+    def connections(self) -> int:
+        return len(self._stop_reading)
+
+    def acquire_request(self, wait: bool = True) -> bool:
+        """Takes a request slot, waiting up to queue_timeout for one when wait is true."""
+        if self._requests.acquire(timeout=self.queue_timeout) if wait else self._requests.acquire(blocking=False):
+            return True
+        metrics.record_rejection("requests")
+        return False
+
+    def release_request(self):
+        self._requests.release()
+
+    def drain(self):
+        """Stops admitting connections and ends every connection's reads; in-flight requests still finish."""
+        with self._lock:
+            self.draining = True
+            stop_reading = list(self._stop_reading.values())
+        for stop in stop_reading:
+            try:
+                stop()
+            except OSError:
+                pass
+
+    def wait_closed(self, timeout: float) -> bool:
+        """Waits for every connection to close; returns False if some are still open after timeout."""
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._stop_reading, timeout)
+
+admission = Admission()
+
+# Reply to a connection or request turned away by admission control
+BUSY_RESPONSE = {"error": "Server busy, retry later", "busy": True, "retry_after": RETRY_AFTER}
+
+# Overridden by --idle-timeout, --read-timeout and --drain-timeout
+idle_timeout = IDLE_TIMEOUT
+read_timeout = READ_TIMEOUT
+drain_timeout = DRAIN_TIMEOUT
+
+def start_server(reuse_port: bool = False) -> None:
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Every worker process listens on the same port and the kernel spreads connections across them
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind(ADDR)
     try:
-        server.listen()
-        print(f"[LISTENING] Server is listening on {SERVER}:{PORT}")
+        server.listen(LISTEN_BACKLOG)
+        logger.info(f"[LISTENING] Server is listening on {SERVER}:{PORT}")
         while True:
             conn, addr = server.accept()
-            thread = threading.Thread(target=handle_client, args=(conn, addr))
+            if not admission.open_connection(conn, lambda conn=conn: conn.shutdown(socket.SHUT_RD)):
+                _reject(conn)
+                continue
+            thread = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
             thread.start()
-            print(f"[ACTIVE CONNECTIONS] {threading.active_count() - 1}")
+            logger.info("[ACTIVE CONNECTIONS] %d", admission.connections)
     except KeyboardInterrupt:
-        print("\n[SHUTDOWN] Server is shutting down...")
+        logger.info("[SHUTDOWN] Server is shutting down...")
     finally:
         server.close()
+        _drain_threaded()
+
+def _reject(conn) -> None:
+    try:
+        conn.settimeout(1)
+        conn.sendall(encode_response(BUSY_RESPONSE))
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+def _drain_threaded() -> None:
+    """Lets in-flight requests finish and their connections close, up to drain_timeout."""
+    admission.drain()
+    if not admission.wait_closed(drain_timeout):
+        logger.warning(f"[SHUTDOWN] {admission.connections} connections still open after {drain_timeout}s")
+
+def start_async_server(reuse_port: bool = False) -> None:
+    try:
+        asyncio.run(_serve_async(reuse_port))
+    except KeyboardInterrupt:
+        logger.info("[SHUTDOWN] Server is shutting down...")
+    finally:
+        db_executor.shutdown(wait=True)
+
+async def _serve_async(reuse_port: bool = False) -> None:
+    server = await asyncio.start_server(handle_client_async, SERVER, PORT, backlog=LISTEN_BACKLOG,
+                                        reuse_port=reuse_port or None)
+    logger.info(f"[LISTENING] Async server is listening on {SERVER}:{PORT}")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    await stop.wait()
+    logger.info("[SHUTDOWN] Server is shutting down...")
+    server.close()
+    admission.drain()
+    deadline = loop.time() + drain_timeout
+    while admission.connections and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+    if admission.connections:
+        logger.warning(f"[SHUTDOWN] {admission.connections} connections still open after {drain_timeout}s")
+
+def encode_response(response_obj, request_id: int = None, compress_above: int = None) -> bytes:
+    """
+    Serializes a response object and prefixes it with the frame header, echoing
+    request_id for protocol 2 requests. Bytes are treated as an already-encoded
+    JSON body and sent as they are. Bodies longer than compress_above are
+    compressed.
+    """
+    if isinstance(response_obj, bytes):
+        response_encoded = response_obj
+    else:
+        response_encoded = serialization.dumps(response_obj)  # Serialize response as JSON
+    frame = encode_frame(response_encoded, request_id, compress_above, compression_level)
+    metrics.add_bytes(sent=len(frame))
+    return frame
 
 def handle_client(conn, addr) -> None:
-    print(f"[NEW CONNECTION] {addr} connected.")
-    connected = True
-    while connected:
-        msg_length = conn.recv(HEADER_SIZE).decode(FORMAT)
-        if msg_length:
-            msg_length = int(msg_length)
-            msg = conn.recv(msg_length).decode(FORMAT)
+    """
+    Serves one connection on its own thread. The connection is closed after
+    idle_timeout without a request, unless it is subscribed to the order
+    feed, and each request waits at most briefly for a free request slot.
+    """
+    logger.info("[NEW CONNECTION] %s connected.", addr)
+    metrics.connection_opened()
+    send_lock = threading.Lock()
+    pusher = PushQueue(conn, send_lock)
+    client = Client(addr, pusher.push)
+
+    def send_response(response_obj, request_id):
+        if isinstance(response_obj, types.GeneratorType):
+            # Streamed responses go out one framed chunk at a time
+            for chunk in response_obj:
+                with send_lock:
+                    conn.sendall(encode_response(chunk, request_id, client.compress_above))
+        else:
+            with send_lock:
+                conn.sendall(encode_response(response_obj, request_id, client.compress_above))
+
+    try:
+        while True:
+            # Subscribed staff connections sit idle on purpose while events are pushed to them
+            conn.settimeout(None if client.feed_token is not None else idle_timeout)
+            try:
+                frame = read_frame(conn, read_timeout)
+            except TimeoutError:
+                logger.info("[TIMEOUT] %s timed out", addr)
+                break
+            if frame is None:
+                break
+            request_id, payload = frame
+            metrics.add_bytes(received=HEADER_SIZE + len(payload))
+            msg = payload.decode(FORMAT)
+            logger.debug("[%s] %s", addr, msg)
             if msg == DISCONNECT_MESSAGE:
-                connected = False
-            print(f"[{addr}] {msg}")
-            response_obj = process_message(msg)
-            response = json.dumps(response_obj)  # Serialize response as JSON
-            response_encoded = response.encode(FORMAT)
-            response_length = len(response_encoded)
-            response_length_str = str(response_length).encode(FORMAT)
-            response_length_str += b' ' * (HEADER_SIZE - len(response_length_str))
-            conn.send(response_length_str)
-            conn.send(response_encoded)
-    conn.close()
-    print(f"[DISCONNECTED] {addr} disconnected.")
-
-def process_message(msg) -> object:
-    """
-    Returns a Python object (dict, list, etc.) which will be serialized once in handle_client().
+                send_response(process_message(msg, client), request_id)
+                break
+            if not admission.acquire_request(wait=True):
+                send_response(BUSY_RESPONSE, request_id)
+                continue
+            try:
+                send_response(process_message(msg, client), request_id)
+            finally:
+                admission.release_request()
+    except (ProtocolError, OSError, UnicodeDecodeError) as e:
+        logger.error("[ERROR] %s: %s", addr, e)
+    finally:
+        client.close()
+        pusher.stop()
+        conn.close()
+        dbm.close()
+        admission.close_connection(conn)
+        metrics.connection_closed()
+    logger.info("[DISCONNECTED] %s disconnected.", addr)
+
+async def handle_client_async(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
     """
+    Event-loop counterpart of handle_client(). An idle connection is just a
+    suspended coroutine, and each request is processed on db_executor.
+    Protocol 2 requests run concurrently, so a pipelining client gets each
+    reply as soon as it is ready; protocol 1 requests are answered in order.
+    """
+    addr = writer.get_extra_info("peername")
+    loop = asyncio.get_running_loop()
+    if not admission.open_connection(writer, reader.feed_eof):
+        writer.write(encode_response(BUSY_RESPONSE))
+        writer.close()
+        return
+    logger.info("[NEW CONNECTION] %s connected.", addr)
+    metrics.connection_opened()
+
+    def send_push(frame: bytes):
+        if writer.transport.get_write_buffer_size() > PUSH_BUFFER_LIMIT:
+            raise ConnectionError("client is not reading pushed events")
+        loop.call_soon_threadsafe(writer.write, frame)
+
+    async def respond(msg, request_id):
+        # The event loop must never block, so a full request queue is answered at once
+        admitted = msg == DISCONNECT_MESSAGE or admission.acquire_request(wait=False)
+        if not admitted:
+            writer.write(encode_response(BUSY_RESPONSE, request_id, client.compress_above))
+            await writer.drain()
+            return
+        try:
+            response_obj = await loop.run_in_executor(db_executor, process_message, msg, client)
+            if isinstance(response_obj, types.GeneratorType):
+                # Each chunk is produced on the executor and flushed before the next is read
+                while (chunk := await loop.run_in_executor(db_executor, next, response_obj, None)) is not None:
+                    writer.write(encode_response(chunk, request_id, client.compress_above))
+                    await writer.drain()
+            else:
+                writer.write(encode_response(response_obj, request_id, client.compress_above))
+                await writer.drain()
+        finally:
+            if msg != DISCONNECT_MESSAGE:
+                admission.release_request()
+
+    async def respond_pipelined(msg, request_id):
+        try:
+            await respond(msg, request_id)
+        except ConnectionError:
+            pass  # the read loop notices the closed connection on its own
+        except Exception as e:
+            logger.error("[ERROR] %s: %r", addr, e)
+        finally:
+            in_flight_slots.release()
+
+    client = Client(addr, send_push)
+    in_flight = set()
+    in_flight_slots = asyncio.Semaphore(MAX_PIPELINED_REQUESTS)
     try:
-        data = json.loads(msg)
-        if (
-            isinstance(data, list) and
-            all(isinstance(item, dict) and "item_id" in item and "item_quantity" in item for item in data)
-        ):
-            print("Creating Order")
-            return dtm.create_order(msg)
-        if isinstance(data, dict) and data.get("payment_complete") is True:
-            print("Processing payment completion")
-            return dtm.payment_complete()
-        if isinstance(data, dict) and data.get("action") == "login":
-            email = data.get("email")
-            password = data.get("password")
-            success = acm.login(email, password)
-            return {"status": "success" if success else "failure"}
-        if isinstance(data, dict) and data.get("action") == "view_pending_orders":
-            print("Fetching pending orders")
-            orders = dtm.get_pending_orders()
-            return orders
-        if isinstance(data, dict) and "order_id" in data and "status" in data:
-            print(f"Completing order {data['order_id']} with status {data['status']}")
-            return dtm.set_order_complete(data["order_id"], data["status"])
-    except json.JSONDecodeError:
-        pass
-    # fallback for 'Get Menu' command
-    if msg == "Get Menu":
-        print("Getting Menu")
-        return dtm.get_menu()
-    return {"error": "Invalid request"}
+        while True:
+            # Subscribed staff connections sit idle on purpose while events are pushed to them
+            timeout = None if client.feed_token is not None else idle_timeout
+            try:
+                frame = await read_frame_async(reader, timeout, read_timeout)
+            except TimeoutError:
+                logger.info("[TIMEOUT] %s timed out", addr)
+                break
+            if frame is None:
+                break
+            request_id, payload = frame
+            metrics.add_bytes(received=HEADER_SIZE + len(payload))
+            msg = payload.decode(FORMAT)
+            logger.debug("[%s] %s", addr, msg)
+            if request_id is None or msg == DISCONNECT_MESSAGE:
+                # Everything before a disconnect is answered before replying to it
+                if in_flight:
+                    await asyncio.wait(in_flight)
+                await respond(msg, request_id)
+            else:
+                await in_flight_slots.acquire()
+                task = asyncio.create_task(respond_pipelined(msg, request_id))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            if msg == DISCONNECT_MESSAGE:
+                break
+    except (ProtocolError, ConnectionError, UnicodeDecodeError) as e:
+        logger.error("[ERROR] %s: %s", addr, e)
+    finally:
+        if in_flight:
+            await asyncio.wait(in_flight)
+        client.close()
+        writer.close()
+        admission.close_connection(writer)
+        metrics.connection_closed()
+        logger.info("[DISCONNECTED] %s disconnected.", addr)
+
+# Handlers keyed by action name. Each takes the decoded message and the Client
+# and returns anything encode_response() accepts (or a generator of chunks).
+ACTIONS = {}
+
+def action(name: str):
+    def register(handler):
+        ACTIONS[name] = handler
+        return handler
+    return register
+
+def resolve_action(data):
+    """
+    Names the action a decoded message asks for. Messages with an "action" key
+    name it themselves; the rest are the original CLI message shapes.
+    """
+    if isinstance(data, dict):
+        if "action" in data:
+            return data["action"]
+        if data.get("payment_complete") is True:
+            return "payment_complete"
+        if "order_id" in data and "status" in data:
+            return "complete_order"
+    elif isinstance(data, list):
+        return "create_order"
+    return None
+
+def process_message(msg, client: Client) -> object:
+    """
+    Returns a Python object (dict, list, etc.) which will be serialized once in handle_client(),
+    bytes that are already encoded, or a generator whose items are sent as separate frames.
+    The time taken is recorded under the action's name; for a generator, once its last chunk is sent.
+    """
+    start = time.perf_counter()
+    name, response_obj = dispatch(msg, client)
+    if isinstance(response_obj, types.GeneratorType):
+        return _timed_stream(name, response_obj, start)
+    failed = isinstance(response_obj, dict) and "error" in response_obj
+    metrics.record_action(name, time.perf_counter() - start, failed)
+    return response_obj
+
+def _timed_stream(name: str, chunks, start: float):
+    """Passes chunks through and records the action once the last one has been sent."""
+    failed = False
+    try:
+        for chunk in chunks:
+            failed = failed or (isinstance(chunk, dict) and "error" in chunk)
+            yield chunk
+    finally:
+        metrics.record_action(name, time.perf_counter() - start, failed)
+
+def dispatch(msg, client: Client) -> tuple:
+    """Returns (action name, response object); the name is "invalid" for unrecognised requests."""
+    if msg == MENU_REQUEST:
+        # The plain-text menu request never needs a JSON decode
+        return "get_menu", ACTIONS["get_menu"](None, client)
+    try:
+        data = serialization.loads(msg)
+    except ValueError:
+        return "invalid", {"error": "Invalid request"}
+    if isinstance(data, dict) and "token" in data:
+        # Staff requests may carry the token from login; a cache hit costs no database access
+        acm.resume(client.session, data["token"])
+    name = resolve_action(data)
+    handler = ACTIONS.get(name) if isinstance(name, str) else None
+    if handler is None:
+        return "invalid", {"error": "Invalid request"}
+    logger.debug("[ACTION] %s", name)
+    try:
+        response_obj = handler(data, client)
+    except Exception as e:
+        # A bad field type must not cost the client its reply or its connection
+        logger.error("[ERROR] %s failed: %r", name, e)
+        return name, {"error": "Request failed"}
+    if isinstance(response_obj, types.GeneratorType):
+        response_obj = _guard_stream(name, response_obj)
+    return name, response_obj
+
+def _guard_stream(name: str, chunks):
+    """Passes chunks through, ending the stream with an error chunk if producing one raises."""
+    try:
+        yield from chunks
+    except Exception as e:
+        logger.error("[ERROR] %s failed mid-stream: %r", name, e)
+        yield {"error": "Request failed", "more": False}
+
+@action("get_menu")
+def _get_menu(data, client):
+    if data and "if_newer_than" in data:
+        return dtm.get_menu_since(data["if_newer_than"], data.get("epoch"))
+    return dtm.get_menu_encoded()
+
+@action("hello")
+def _hello(data, client):
+    requested = data.get("protocol", 1)
+    if isinstance(requested, int) and requested >= 1:
+        client.protocol = min(requested, PROTOCOL_VERSION)
+    response = {"protocol": client.protocol}
+    # Compressed frames are flagged in the protocol 2 header, so protocol 1 cannot carry them
+    if data.get("compression") == COMPRESSION and client.protocol >= 2:
+        client.compress_above = compression_threshold
+        response["compression"] = COMPRESSION
+    return response
+
+@action("login")
+def _login(data, client):
+    token = acm.login(client.session, data.get("email"), data.get("password"))
+    if token is None:
+        return {"status": "failure"}
+    return {"status": "success", "token": token, "expires_in": TOKEN_TTL}
+
+@action("resume")
+def _resume(data, client):
+    # process_message() has already logged the session in if the token is valid
+    valid = acm.resolve_token(data.get("token")) is not None
+    return {"status": "success" if valid else "failure"}
+
+@action("logout")
+def _logout(data, client):
+    acm.logout(client.session, data.get("token"))
+    return {"status": "success"}
+
+@action("create_order")
+def _create_order(data, client):
+    return dtm.create_order(client.session, data)
+
+@action("payment_complete")
+def _payment_complete(data, client):
+    return dtm.payment_complete(client.session)
+
+@action("bulk_order")
+def _bulk_order(data, client):
+    return dtm.create_orders_bulk(client.session, data.get("orders"))
+
+@action("complete_order")
+def _complete_order(data, client):
+    return dtm.set_order_complete(client.session, data.get("order_id"), data.get("status"))
+
+@action("complete_orders")
+def _complete_orders(data, client):
+    return dtm.complete_orders(client.session, data.get("order_ids"), data.get("status", True))
 
+@action("stats")
+def _stats(data, client):
+    return dtm.get_stats(client.session)
+
+@action("metrics")
+def _metrics(data, client):
+    if not client.session.logged_in:
+        return "Access Denied: Staff Only Operation"
+    return metrics.snapshot()
+
+@action("upsert_menu_items")
+def _upsert_menu_items(data, client):
+    return dtm.upsert_menu_items(client.session, data.get("items"))
+
+@action("import_menu")
+def _import_menu(data, client):
+    return dtm.import_menu(client.session, data.get("data"), data.get("format", "csv"))
+
+@action("set_menu_items_enabled")
+def _set_menu_items_enabled(data, client):
+    return dtm.set_menu_items_enabled(client.session, data.get("item_ids"), bool(data.get("enabled", True)))
+
+@action("export_menu")
+def _export_menu(data, client):
+    limit = data.get("limit", MENU_EXPORT_PAGE_SIZE)
+    if not isinstance(limit, int) or limit < 1:
+        return {"error": "limit must be a positive integer"}
+    return dtm.export_menu(client.session, data.get("format", "csv"), limit)
+
+@action("item_totals")
+def _item_totals(data, client):
+    item_id = data.get("item_id")
+    if item_id is not None and not isinstance(item_id, int):
+        return {"error": "item_id must be an integer"}
+    return dtm.get_item_totals(client.session, bool(data.get("completed")), item_id)
+
+@action("subscribe_pending_orders")
+def _subscribe_pending_orders(data, client):
+    if client.feed_token is not None:
+        return {"error": "Already subscribed"}
+    subscription = dtm.subscribe_pending_orders(client.session, client.push, client.feed_dropped)
+    if isinstance(subscription, str):
+        return subscription
+    client.feed_token, orders = subscription
+    return {"subscribed": True, "orders": orders}
+
+@action("unsubscribe_pending_orders")
+def _unsubscribe_pending_orders(data, client):
+    client.unsubscribe()
+    return {"subscribed": False}
+
+def _view_orders(data, session: Session, completed: bool):
+    after_id = data.get("after_id", 0)
+    limit = data.get("limit", ORDER_PAGE_SIZE)
+    if not isinstance(after_id, int) or not isinstance(limit, int) or limit < 1:
+        return {"error": "after_id and limit must be integers"}
+    if data.get("stream"):
+        return dtm.stream_orders(session, completed, after_id, limit)
+    if completed:
+        return dtm.get_completed_orders_page(session, after_id, limit)
+    return dtm.get_pending_orders_page(session, after_id, limit)
+
+@action("view_pending_orders")
+def _view_pending_orders(data, client):
+    if not {"after_id", "limit", "stream"} & data.keys():
+        return dtm.get_pending_orders(client.session)
+    return _view_orders(data, client.session, completed=False)
+
+@action("view_completed_orders")
+def _view_completed_orders(data, client):
+    if "start_date" in data or "end_date" in data:
+        return dtm.get_completed_orders(client.session, data.get("start_date"), data.get("end_date"))
+    return _view_orders(data, client.session, completed=True)
+
+@action("export_orders")
+def _export_orders(data, client):
+    after_seq = data.get("after_seq", 0)
+    limit = data.get("limit", ORDER_EXPORT_BATCH_SIZE)
+    if not isinstance(after_seq, int) or not isinstance(limit, int) or limit < 1:
+        return {"error": "after_seq and limit must be integers"}
+    return dtm.export_completed_orders(client.session, data.get("format", "csv"), after_seq, data.get("since"), limit)
+
+@action("archive_orders")
+def _archive_orders(data, client):
+    return dtm.archive_completed_orders(client.session, data.get("retention_days", ARCHIVE_RETENTION_DAYS))
+
+def start_archiver(interval: float, retention_days: int) -> threading.Event:
+    """Archives old completed orders every interval seconds until the returned event is set."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                result = dtm._archive_completed_orders(retention_days)
+            except Exception as e:
+                logger.error(f"[ARCHIVE] Failed: {e}")
+                continue
+            if result["archived"]:
+                logger.info(f"[ARCHIVE] Archived {result['archived']} orders from {len(result['days'])} days")
+
+    threading.Thread(target=run, name="archiver", daemon=True).start()
+    return stop
+
+
+def run_server(args, worker_id: int = None) -> None:
+    """Serves clients in this process until it is interrupted; worker_id is set for pre-forked workers."""
+    prefix = f"[WORKER {worker_id}] " if worker_id is not None else ""
+    log_listener = setup_logging("DEBUG" if args.verbose else args.log_level, prefix)
+    metrics_file = args.metrics_file
+    if metrics_file and worker_id is not None:
+        metrics_file = f"{metrics_file}.{worker_id}"
+    logger.info(f"[JSON] Using {serialization.set_backend(args.json_backend)}")
+    if args.group_commit:
+        dbm.start_writer(args.commit_batch, args.commit_window)
+    if dtm.changes is not None:
+        dtm.changes.start(worker_id, dtm.apply_change)
+    if metrics_file:
+        metrics.start_dump(metrics_file, args.metrics_interval)
+    archiver = None
+    if args.archive_interval and not worker_id:
+        # With several workers only the first one archives
+        archiver = start_archiver(args.archive_interval, args.retention_days)
+    if not args.use_async:
+        # The async server installs its own handlers so it can drain from inside the event loop
+        signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        if args.use_async:
+            start_async_server(reuse_port=worker_id is not None)
+        else:
+            start_server(reuse_port=worker_id is not None)
+    finally:
+        if archiver is not None:
+            archiver.set()
+        if dtm.changes is not None:
+            dtm.changes.stop()
+        dbm.stop_writer()
+        if metrics_file:
+            metrics.stop_dump()
+            metrics.dump(metrics_file)
+        if log_listener is not None:
+            log_listener.stop()
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def run_workers(args) -> None:
+    """
+    Pre-forks args.workers server processes that all listen on PORT with
+    SO_REUSEPORT. They share the database file: each commits through its own
+    group-commit writer, SQLite's busy timeout queues them for the write
+    lock, and a ChangeLog carries menu and order changes between them.
+    """
+    acm.changes = dtm.changes = ChangeLog(dbm)
+    # Connections must not cross a fork; each worker opens its own
+    dbm.close()
+    children = []
+    for worker_id in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, _interrupt)
+            try:
+                run_server(args, worker_id)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    log_listener = setup_logging("DEBUG" if args.verbose else args.log_level)
+    logger.info(f"[WORKERS] Started {len(children)} workers on {SERVER}:{PORT}")
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            os.waitpid(pid, 0)
+    finally:
+        if log_listener is not None:
+            log_listener.stop()
 
-start_server()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SmartServe order server")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="serve clients from a single asyncio event loop instead of one thread per connection")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server processes sharing the port through SO_REUSEPORT, e.g. one per core")
+    parser.add_argument("--host", default=SERVER, help="address to listen on")
+    parser.add_argument("--port", type=int, default=PORT, help="port to listen on")
+    parser.add_argument("--json", dest="json_backend", choices=serialization.BACKENDS, default=JSON_BACKEND,
+                        help="JSON library used to decode requests and encode responses")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default=LOG_LEVEL,
+                        help="lowest level logged; DEBUG logs every request, OFF disables logging")
+    parser.add_argument("--verbose", action="store_true",
+                        help="shorthand for --log-level DEBUG")
+    parser.add_argument("--metrics-file",
+                        help="periodically write a metrics snapshot to this file (one per worker)")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_DUMP_INTERVAL,
+                        help="seconds between metrics snapshots written to --metrics-file")
+    parser.add_argument("--no-group-commit", dest="group_commit", action="store_false",
+                        help="commit every order write on its own instead of batching them in a writer thread")
+    parser.add_argument("--commit-window", type=float, default=GROUP_COMMIT_WINDOW,
+                        help="seconds the writer waits to gather more writes into a batch")
+    parser.add_argument("--commit-batch", type=int, default=GROUP_COMMIT_MAX_BATCH,
+                        help="most writes committed together in one batch")
+    parser.add_argument("--archive-interval", type=float, default=0,
+                        help="seconds between runs of the completed-order archival job; 0 disables it")
+    parser.add_argument("--retention-days", type=int, default=ARCHIVE_RETENTION_DAYS,
+                        help="days of completed orders kept in the database before they are archived")
+    parser.add_argument("--compress-threshold", type=int, default=COMPRESSION_THRESHOLD,
+                        help="bytes above which replies to clients that negotiated compression are zlib-compressed")
+    parser.add_argument("--compress-level", type=int, choices=range(0, 10), default=COMPRESSION_LEVEL,
+                        metavar="0-9", help="zlib compression level")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="open connections per process; further connections are told the server is busy")
+    parser.add_argument("--max-queued-requests", type=int, default=MAX_QUEUED_REQUESTS,
+                        help="requests queued or running at once per process before new ones are rejected")
+    parser.add_argument("--queue-timeout", type=float, default=QUEUE_TIMEOUT,
+                        help="seconds a threaded-mode request waits for a free slot before it is rejected")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="seconds without a request before a connection is closed")
+    parser.add_argument("--read-timeout", type=float, default=READ_TIMEOUT,
+                        help="seconds allowed to receive the rest of a frame once it has started")
+    parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT,
+                        help="seconds a shutdown waits for in-flight requests to finish")
+    args = parser.parse_args()
+    SERVER, PORT = args.host, args.port
+    ADDR = (SERVER, PORT)
+    compression_threshold, compression_level = args.compress_threshold, args.compress_level
+    admission = Admission(args.max_connections, args.max_queued_requests, args.queue_timeout)
+    idle_timeout, read_timeout, drain_timeout = args.idle_timeout, args.read_timeout, args.drain_timeout
+    if args.workers > 1:
+        if not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork"):
+            parser.error("--workers needs a platform with fork() and SO_REUSEPORT")
+        run_workers(args)
+    else:
+        run_server(args)
@@ -0,0 +1,245 @@
+"""
+Load generator and latency benchmark for the SmartServe server.
+
+Starts backend.server against a temporary SQLite file, then runs simulated
+clients against it over the same wire protocol as cli.py:
+
+  * students loop: fetch the menu -> create_order -> payment_complete
+  * staff log in and loop: view pending orders -> complete them
+
+When the run ends it prints throughput and p50/p95/p99 latency for each
+action and writes them to a JSON file. Pass an earlier results file to
+--compare to see what changed between two versions.
+
+    python benchmark.py --students 50 --staff 2 --duration 10 --output bench.json
+    python benchmark.py --server-args="--async" --compare bench.json
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from helpers.constants import DB_PATH_ENV, FORMAT, MENU_REQUEST
+from helpers.app_helpers import DatabaseManager, AccountManager, DataManager, Session
+from helpers.protocol import encode_frame, read_frame
+from tabulate import tabulate
+
+HOST = "127.0.0.1"
+STAFF_EMAIL = "bench-staff@smartserve"
+STAFF_PASSWORD = "bench"
+MENU = [("Samosa", 10), ("Tea", 4), ("Coffee", 8), ("Dosa", 30),
+        ("Idli", 20), ("Vada", 12), ("Juice", 25), ("Sandwich", 35)]
+
+def seed_database(db_path: str) -> None:
+    """Creates the staff account and menu the simulated clients use."""
+    dbm = DatabaseManager(db_path)
+    acm = AccountManager(dbm)
+    dtm = DataManager(acm)
+    acm.create_account(STAFF_EMAIL, STAFF_PASSWORD)
+    session = Session()
+    session.logged_in = True
+    for name, price in MENU:
+        dtm.add_menu_item(session, name, price)
+    dbm.close()
+
+def start_server(db_path: str, port: int, server_args: list) -> subprocess.Popen:
+    env = dict(os.environ, **{DB_PATH_ENV: db_path})
+    process = subprocess.Popen(
+        [sys.executable, "-m", "backend.server", "--host", HOST, "--port", str(port), *server_args],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            socket.create_connection((HOST, port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server did not start listening in time")
+
+class BenchClient:
+    """One simulated connection. Every request is timed under its action name."""
+    def __init__(self, port: int, samples: defaultdict, errors: defaultdict):
+        self.sock = socket.create_connection((HOST, port))
+        self.samples = samples
+        self.errors = errors
+
+    def request(self, action: str, msg):
+        if not isinstance(msg, str):
+            msg = json.dumps(msg)
+        start = time.perf_counter()
+        self.sock.sendall(encode_frame(msg.encode(FORMAT)))
+        frame = read_frame(self.sock)
+        elapsed = time.perf_counter() - start
+        if frame is None:
+            raise ConnectionError("Server closed the connection")
+        response = json.loads(frame[1])
+        self.samples[action].append(elapsed)
+        if isinstance(response, dict) and "error" in response:
+            self.errors[action] += 1
+        return response
+
+    def close(self):
+        self.sock.close()
+
+def run_student(port: int, deadline: float, samples, errors) -> None:
+    client = BenchClient(port, samples, errors)
+    try:
+        while time.monotonic() < deadline:
+            menu = client.request("get_menu", MENU_REQUEST)
+            if not isinstance(menu, list):
+                # A busy or error reply was already counted; back off before the next round
+                time.sleep(menu.get("retry_after", 0) if isinstance(menu, dict) else 0)
+                continue
+            menu = [item for item in menu if item["enabled"]]
+            order = [
+                {"item_id": item["item_id"], "item_quantity": random.randint(1, 3)}
+                for item in random.sample(menu, random.randint(1, min(3, len(menu))))
+            ]
+            client.request("create_order", order)
+            client.request("payment_complete", {"payment_complete": True})
+    finally:
+        client.close()
+
+def run_staff(port: int, deadline: float, samples, errors, page_size: int, interval: float) -> None:
+    client = BenchClient(port, samples, errors)
+    try:
+        token = None
+        while token is None and time.monotonic() < deadline:
+            response = client.request("login", {"action": "login", "email": STAFF_EMAIL, "password": STAFF_PASSWORD})
+            token = response.get("token")
+            if token is None:
+                time.sleep(response.get("retry_after", interval))
+        while time.monotonic() < deadline:
+            page = client.request("view_pending_orders", {
+                "action": "view_pending_orders", "token": token, "after_id": 0, "limit": page_size
+            })
+            order_ids = [order["order_id"] for order in page.get("orders", [])]
+            if order_ids:
+                client.request("complete_orders", {"action": "complete_orders", "token": token, "order_ids": order_ids})
+            else:
+                time.sleep(interval)
+    finally:
+        client.close()
+
+def percentile(sorted_samples: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_samples) - 1, round(fraction * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+def summarize(samples: dict, errors: dict, elapsed: float) -> dict:
+    summary = {}
+    for action, timings in sorted(samples.items()):
+        timings = sorted(timings)
+        summary[action] = {
+            "count": len(timings),
+            "errors": errors.get(action, 0),
+            "throughput": round(len(timings) / elapsed, 2),
+            "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+            "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+            "max_ms": round(timings[-1] * 1000, 3)
+        }
+    return summary
+
+def print_report(results: dict, baseline: dict = None) -> None:
+    columns = ["count", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    rows = []
+    for action, stats in results["actions"].items():
+        row = [action] + [stats[column] for column in columns]
+        previous = (baseline or {}).get("actions", {}).get(action)
+        if baseline is not None:
+            row += [_change(previous, stats, "throughput"), _change(previous, stats, "p95_ms")]
+        rows.append(row)
+    headers = ["Action", "Count", "Errors", "Req/s", "p50 ms", "p95 ms", "p99 ms", "Max ms"]
+    if baseline is not None:
+        headers += ["Req/s vs base", "p95 vs base"]
+    print(tabulate(rows, headers=headers, tablefmt="grid"))
+    print(f"Orders placed: {results['orders_placed']} in {results['elapsed']}s "
+          f"({results['orders_per_second']} orders/s)")
+
+def _change(previous: dict, current: dict, key: str) -> str:
+    if not previous or not previous.get(key):
+        return "-"
+    return f"{(current[key] - previous[key]) / previous[key] * 100:+.1f}%"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SmartServe load generator and latency benchmark")
+    parser.add_argument("--students", type=int, default=20, help="simulated student clients")
+    parser.add_argument("--staff", type=int, default=2, help="simulated staff clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to generate load for")
+    parser.add_argument("--port", type=int, default=5099, help="port for the benchmark server")
+    parser.add_argument("--page-size", type=int, default=50, help="pending orders a staff client completes at once")
+    parser.add_argument("--staff-interval", type=float, default=0.05,
+                        help="seconds a staff client waits when there is nothing pending")
+    parser.add_argument("--server-args", default="", help='extra backend.server arguments, e.g. "--async"')
+    parser.add_argument("--output", default="benchmark_results.json", help="file the results are written to")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    with tempfile.TemporaryDirectory(prefix="smartserve-bench-") as tmp:
+        db_path = os.path.join(tmp, "bench.sqlite")
+        seed_database(db_path)
+        server = start_server(db_path, args.port, args.server_args.split())
+        try:
+            start = time.monotonic()
+            deadline = start + args.duration
+            threads = [
+                threading.Thread(target=run_student, args=(args.port, deadline, samples, errors))
+                for _ in range(args.students)
+            ] + [
+                threading.Thread(target=run_staff, args=(args.port, deadline, samples, errors,
+                                                         args.page_size, args.staff_interval))
+                for _ in range(args.staff)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - start
+        finally:
+            server.terminate()
+            server.wait()
+
+    orders_placed = len(samples["payment_complete"]) - errors.get("payment_complete", 0)
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "students": args.students,
+            "staff": args.staff,
+            "duration": args.duration,
+            "page_size": args.page_size,
+            "server_args": args.server_args,
+            # BenchClient never sends hello, so it speaks the original protocol
+            "protocol": 1,
+            "python": sys.version.split()[0]
+        },
+        "elapsed": round(elapsed, 3),
+        "orders_placed": orders_placed,
+        "orders_per_second": round(orders_placed / elapsed, 2),
+        "actions": summarize(samples, errors, elapsed)
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
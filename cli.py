@@ -1,26 +1,122 @@
+import os
 import socket
+import time
+import select
 import json
-from helpers.constants import PORT, FORMAT, HEADER_SIZE, DISCONNECT_MESSAGE
+from collections import defaultdict, deque
+from helpers.constants import PORT, FORMAT, DISCONNECT_MESSAGE, ORDER_PAGE_SIZE, PROTOCOL_VERSION, PUSH_REQUEST_ID, TOKEN_FILE, MENU_CACHE_FILE, COMPRESSION, BUSY_RETRIES
+from helpers.protocol import encode_frame, read_frame
 from tabulate import tabulate
 import cmd
 
 SERVER = socket.gethostbyname(socket.gethostname())
 ADDR = (SERVER, PORT)
 client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+TOKEN_PATH = os.path.join(os.path.expanduser("~"), TOKEN_FILE)
+MENU_CACHE_PATH = os.path.join(os.path.expanduser("~"), MENU_CACHE_FILE)
+
+# Frames the server pushes on its own (order events) rather than in reply to a request
+EVENT_PREFIX = '{"event"'
+
+# Negotiated by negotiate(); protocol 2 tags each request so replies can be matched by id
+protocol = 1
+_next_request_id = PUSH_REQUEST_ID + 1
+# Replies that arrived while we were waiting for a different request
+_replies = defaultdict(deque)
+# Events that arrived while waiting for a reply; only kept while a watch is active
+_events = deque()
+_keep_events = False
+
+def negotiate() -> None:
+    """
+    Switches the connection to protocol 2 if the server supports it, and asks
+    for large replies to be compressed; read_frame() undoes the compression.
+    """
+    global protocol
+    try:
+        response = json.loads(send(json.dumps({"action": "hello", "protocol": PROTOCOL_VERSION, "compression": COMPRESSION})))
+    except json.JSONDecodeError:
+        return
+    if isinstance(response, dict) and isinstance(response.get("protocol"), int):
+        protocol = response["protocol"]
+
+def send_request(msg: str):
+    """Sends msg without waiting for the reply and returns its request id (None on protocol 1)."""
+    global _next_request_id
+    request_id = None
+    if protocol >= 2:
+        request_id = _next_request_id
+        _next_request_id += 1
+    client.sendall(encode_frame(msg.encode(FORMAT), request_id))
+    return request_id
+
+def _read_frame() -> tuple:
+    """Returns (request_id, response, is_event) for the next frame from the server."""
+    frame = read_frame(client)
+    if frame is None:
+        raise ConnectionError("Server closed the connection")
+    request_id, payload = frame
+    response = payload.decode(FORMAT)
+    if request_id is None:
+        is_event = response.startswith(EVENT_PREFIX)
+    else:
+        is_event = request_id == PUSH_REQUEST_ID
+    return request_id, response, is_event
+
+def recv_response(request_id=None) -> str:
+    """
+    Returns the next reply to request_id. Replies to other requests are kept
+    for later. Events are kept for recv_event() while a watch is active, and
+    events still in flight from a watch that has ended are dropped.
+    """
+    while not _replies[request_id]:
+        frame_id, response, is_event = _read_frame()
+        if not is_event:
+            _replies[frame_id].append(response)
+        elif _keep_events:
+            _events.append(response)
+    response = _replies[request_id].popleft()
+    if not _replies[request_id]:
+        del _replies[request_id]
+    return response
+
+def recv_event() -> str:
+    """Returns the next pushed event, keeping any replies that arrive first."""
+    if _events:
+        return _events.popleft()
+    while True:
+        frame_id, response, is_event = _read_frame()
+        if is_event:
+            return response
+        _replies[frame_id].append(response)
 
 def send(msg: str) -> str:
-    message_encoded = msg.encode(FORMAT)
-    msg_length = len(message_encoded)
-    send_length = str(msg_length).encode(FORMAT)
-    send_length += b' ' * (HEADER_SIZE - len(send_length))
-    client.send(send_length)
-    client.send(message_encoded)
-    response_length = client.recv(HEADER_SIZE).decode(FORMAT)
-    if response_length:
-        response_length = int(response_length)
-        response = client.recv(response_length).decode(FORMAT)
-        return response
-    return ""
+    """Sends msg and returns the reply, retrying a few times if the server says it is busy."""
+    for _ in range(BUSY_RETRIES):
+        response = recv_response(send_request(msg))
+        retry_after = _busy_retry_after(response)
+        if retry_after is None:
+            return response
+        time.sleep(retry_after)
+    return recv_response(send_request(msg))
+
+def _busy_retry_after(response: str):
+    """Returns the seconds to wait if response is the server's busy reply, otherwise None."""
+    if not response.startswith('{"error"'):
+        return None
+    try:
+        response = json.loads(response)
+    except json.JSONDecodeError:
+        return None
+    return response.get("retry_after") if response.get("busy") else None
+
+def send_many(msgs: list) -> list:
+    """
+    Pipelines independent requests: all are sent before any reply is awaited.
+    Replies are returned in request order however the server orders them.
+    """
+    request_ids = [send_request(msg) for msg in msgs]
+    return [recv_response(request_id) for request_id in request_ids]
 
 class Cli(cmd.Cmd):
     intro = "Welcome to SmartServe. Type help or ? to list commands.\n"
@@ -29,6 +125,33 @@ class Cli(cmd.Cmd):
     def __init__(self):
         super().__init__()
         self.logged_in = False
+        self.token = None
+        self.menu = None
+        self.menu_version = None
+        self.menu_epoch = None
+
+    def preloop(self):
+        """Resume the staff session saved by an earlier login, if it is still valid."""
+        self._load_menu_cache()
+        try:
+            with open(TOKEN_PATH) as f:
+                token = f.read().strip()
+        except OSError:
+            return
+        try:
+            response = json.loads(send(json.dumps({"action": "resume", "token": token})))
+        except json.JSONDecodeError:
+            return
+        if response.get("status") == "success":
+            self.logged_in = True
+            self.token = token
+            print("Resumed staff session.")
+
+    def _staff_message(self, payload) -> str:
+        """Encodes a staff request, attaching the session token so the server can re-authenticate cheaply."""
+        if self.token:
+            payload = dict(payload, token=self.token)
+        return json.dumps(payload)
 
     def do_login(self, arg):
         """Login as staff user."""
@@ -46,18 +169,29 @@ class Cli(cmd.Cmd):
         if response.get("status") == "success":
             print("Login successful.")
             self.logged_in = True
+            self.token = response.get("token")
+            if self.token:
+                with open(TOKEN_PATH, "w") as f:
+                    f.write(self.token)
+                os.chmod(TOKEN_PATH, 0o600)
         else:
             print("Login failed:", response.get("error", "Invalid login credentials"))
 
+    def do_logout(self, arg):
+        """Log out and forget the saved staff session."""
+        send(json.dumps({"action": "logout", "token": self.token}))
+        self.logged_in = False
+        self.token = None
+        try:
+            os.remove(TOKEN_PATH)
+        except OSError:
+            pass
+        print("Logged out.")
+
     def do_get_menu(self, arg):
         """Get and display the current menu with unavailable items at bottom"""
-        raw_response = send("Get Menu")
-        try:
-            menu_data = json.loads(raw_response)
-            if isinstance(menu_data, str):
-                menu_data = json.loads(menu_data)
-        except json.JSONDecodeError:
-            print("Error decoding server response.")
+        menu_data = self._get_menu_data()
+        if not menu_data:
             return
         headers = ["item_id", "item_name", "item_price", "available"]
         enabled_items = [item for item in menu_data if item["enabled"]]
@@ -67,19 +201,59 @@ class Cli(cmd.Cmd):
         rows.extend([[item["item_id"], item["item_name"], item["item_price"], "No"] for item in disabled_items])
         print(tabulate(rows, headers=headers, tablefmt="fancy_grid"))
 
+    def _load_menu_cache(self):
+        try:
+            with open(MENU_CACHE_PATH) as f:
+                cache = json.load(f)
+            self.menu, self.menu_version, self.menu_epoch = cache["menu"], cache["version"], cache["epoch"]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.menu, self.menu_version, self.menu_epoch = None, None, None
+
+    def _save_menu_cache(self):
+        try:
+            with open(MENU_CACHE_PATH, "w") as f:
+                json.dump({"epoch": self.menu_epoch, "version": self.menu_version, "menu": self.menu}, f)
+        except OSError:
+            pass
+
     def _get_menu_data(self, ids_only=False):
-        raw_response = send("Get Menu")
+        """
+        Returns the menu, asking the server only for what changed since the
+        cached copy; an unchanged menu costs a reply of a few bytes. The cache
+        is only trusted by a server whose database has the same menu epoch.
+        """
+        version = self.menu_version if self.menu is not None else None
+        raw_response = send(json.dumps({"action": "get_menu", "if_newer_than": version, "epoch": self.menu_epoch}))
         try:
-            menu_data = json.loads(raw_response)
-            if isinstance(menu_data, str):
-                menu_data = json.loads(menu_data)
+            response = json.loads(raw_response)
         except json.JSONDecodeError:
             print("Error decoding server response.")
             return []
+        if not isinstance(response, dict) or "version" not in response:
+            print("Unexpected menu response from server.")
+            return []
+
+        if response.get("epoch") != self.menu_epoch:
+            # Another server or a recreated database: nothing cached applies
+            self.menu = self.menu_version = None
+            self.menu_epoch = response.get("epoch")
+        if "menu" in response:
+            self.menu = response["menu"]
+        elif self.menu is None:
+            print("Unexpected menu response from server.")
+            return []
+        elif not response.get("not_modified"):
+            removed = set(response.get("removed", []))
+            items = {item["item_id"]: item for item in self.menu if item["item_id"] not in removed}
+            items.update((item["item_id"], item) for item in response.get("changed", []))
+            self.menu = [items[item_id] for item_id in sorted(items)]
+        if response["version"] != self.menu_version or "menu" in response:
+            self.menu_version = response["version"]
+            self._save_menu_cache()
 
         if ids_only:
-            return [item["item_id"] for item in menu_data if item["enabled"]]
-        return menu_data
+            return [item["item_id"] for item in self.menu if item["enabled"]]
+        return self.menu
 
     def do_send_order(self, arg):
         """Create a new order using item ID and quantity."""
@@ -143,63 +317,290 @@ class Cli(cmd.Cmd):
             print("Payment confirmed.\nReceipt:")
             print(f"Total Price: {receipt.get('total_price', 'N/A')}")
             for item in receipt.get("items_ordered", []):
-                print(f"Item ID: {item.get('item_id')}, Name: {item.get('item_name')}, Price: {item.get('item_price')}")
+                print(f"Item ID: {item.get('item_id')}, Name: {item.get('item_name')}, "
+                      f"Price: {item.get('item_price')}, Quantity: {item.get('quantity', 1)}")
         else:
             print("Payment not completed. Order not confirmed.")
 
     def do_view_orders(self, arg):
-        """View all pending orders (staff only)."""
+        """
+        View orders page by page (staff only). Usage: view_orders [completed [start_date [end_date]]]
+        With dates (YYYY-MM-DD), completed orders in that range are shown, including archived ones.
+        """
         if not self.logged_in:
             print("You must login to view orders.")
             return
-        response_str = send(json.dumps({"action": "view_pending_orders"}))
+        args = arg.split()
+        kind = "completed" if args and args[0].lower() == "completed" else "pending"
+        if kind == "completed" and len(args) > 1:
+            self._view_completed_range(args[1], args[2] if len(args) > 2 else args[1])
+            return
+        request_id = send_request(self._staff_message({"action": f"view_{kind}_orders", "stream": True, "limit": ORDER_PAGE_SIZE}))
+        response_str = recv_response(request_id)
+        shown = 0
+        while True:
+            try:
+                page = json.loads(response_str)
+            except json.JSONDecodeError:
+                print("Error decoding server response.")
+                return
+            if isinstance(page, str):
+                print(page)
+                return
+            if "error" in page:
+                print("Error:", page["error"])
+                return
+            if page["orders"]:
+                if not shown:
+                    print(f"{kind.capitalize()} Orders:")
+                self._display_orders(page["orders"])
+                shown += len(page["orders"])
+            if not page["more"]:
+                break
+            response_str = recv_response(request_id)
+        if not shown:
+            print(f"No {kind} orders at the moment.")
+
+    def _view_completed_range(self, start_date, end_date):
+        response_str = send(self._staff_message({
+            "action": "view_completed_orders", "start_date": start_date, "end_date": end_date
+        }))
         try:
             orders = json.loads(response_str)
-            if isinstance(orders, dict) and "error" in orders:
-                print("Error:", orders["error"])
-            elif orders:
-                print("Pending Orders:")
-                self._display_orders(orders)
-            else:
-                print("No pending orders at the moment.")
         except json.JSONDecodeError:
             print("Error decoding server response.")
+            return
+        if isinstance(orders, str):
+            print(orders)
+        elif isinstance(orders, dict):
+            print("Error:", orders.get("error"))
+        elif not orders:
+            print(f"No completed orders from {start_date} to {end_date}.")
+        else:
+            print(f"Completed Orders from {start_date} to {end_date}:")
+            self._display_orders(orders)
 
     def do_complete_order(self, arg):
-        """Complete an order by its order ID. Usage: complete [order_id] (staff only)."""
+        """Complete one or more orders by ID. Usage: complete_order order_id [order_id ...] (staff only)."""
         if not self.logged_in:
             print("You must login to complete orders.")
             return
         try:
-            order_id = int(arg.strip())
+            order_ids = [int(order_id) for order_id in arg.split()]
         except ValueError:
-            print("Please provide a valid order ID.")
+            print("Please provide valid order IDs.")
+            return
+        if not order_ids:
+            print("Please provide at least one order ID.")
             return
 
-        msg = json.dumps({"order_id": order_id, "status": True})
+        msg = self._staff_message({"action": "complete_orders", "order_ids": order_ids, "status": True})
         response_str = send(msg)
         try:
-            updated_orders = json.loads(response_str)
-            if isinstance(updated_orders, str):
-                print(updated_orders)
-                return
-            print(f"Order {order_id} marked as completed.\n")
-            print("Updated Pending Orders:")
-            self._display_orders(updated_orders)
+            response = json.loads(response_str)
+        except json.JSONDecodeError:
+            print("Error decoding server response.")
+            return
+        if isinstance(response, str):
+            print(response)
+            return
+        if "error" in response:
+            print("Error:", response["error"])
+            return
+        if response["order_ids"]:
+            print("Marked as completed:", ", ".join(str(order_id) for order_id in response["order_ids"]))
+        if response["not_found"]:
+            print("Not pending:", ", ".join(str(order_id) for order_id in response["not_found"]))
+
+    def _staff_request(self, payload):
+        """Sends a staff request and returns the decoded reply, or None after printing why it failed."""
+        try:
+            response = json.loads(send(self._staff_message(payload)))
+        except json.JSONDecodeError:
+            print("Error decoding server response.")
+            return None
+        if isinstance(response, str):
+            print(response)
+            return None
+        if isinstance(response, dict) and "error" in response:
+            print("Error:", response["error"])
+            return None
+        return response
+
+    def do_import_menu(self, arg):
+        """Add or update menu items from a CSV or JSONL file in one go. Usage: import_menu path (staff only)."""
+        if not self.logged_in:
+            print("You must login to import a menu.")
+            return
+        path = arg.strip()
+        if not path:
+            print("Please provide the file to import.")
+            return
+        try:
+            with open(path, encoding=FORMAT) as f:
+                data = f.read()
+        except OSError as e:
+            print(f"Could not read {path}: {e}")
+            return
+        fmt = "jsonl" if path.lower().endswith((".jsonl", ".json")) else "csv"
+        response = self._staff_request({"action": "import_menu", "format": fmt, "data": data})
+        if response is not None:
+            print(f"Menu imported: {response['inserted']} added, {response['updated']} updated.")
+
+    def do_export_menu(self, arg):
+        """Save the whole menu to a file; .jsonl paths get JSON Lines, others CSV. Usage: export_menu path (staff only)."""
+        if not self.logged_in:
+            print("You must login to export the menu.")
+            return
+        path = arg.strip()
+        if not path:
+            print("Please provide the file to export to.")
+            return
+        fmt = "jsonl" if path.lower().endswith(".jsonl") else "csv"
+        request_id = send_request(self._staff_message({"action": "export_menu", "format": fmt}))
+        with open(path, "w", encoding=FORMAT, newline="") as f:
+            while True:
+                try:
+                    chunk = json.loads(recv_response(request_id))
+                except json.JSONDecodeError:
+                    print("Error decoding server response.")
+                    return
+                if not isinstance(chunk, dict) or "data" not in chunk:
+                    print(chunk.get("error") if isinstance(chunk, dict) else chunk)
+                    return
+                f.write(chunk["data"])
+                if not chunk["more"]:
+                    break
+        print(f"Menu exported to {path}.")
+
+    def do_export_orders(self, arg):
+        """
+        Save completed orders to a file; .jsonl paths get JSON Lines, others CSV (staff only).
+        Usage: export_orders path [watermark | since_date]
+        Pass the watermark printed by the previous export to get only the orders completed since.
+        """
+        if not self.logged_in:
+            print("You must login to export orders.")
+            return
+        args = arg.split()
+        if not args or len(args) > 2:
+            print("Usage: export_orders path [watermark | since_date]")
+            return
+        path = args[0]
+        message = {"action": "export_orders", "format": "jsonl" if path.lower().endswith(".jsonl") else "csv"}
+        if len(args) == 2:
+            if args[1].isdigit():
+                message["after_seq"] = int(args[1])
+            else:
+                message["since"] = args[1]
+        request_id = send_request(self._staff_message(message))
+        with open(path, "w", encoding=FORMAT, newline="") as f:
+            while True:
+                try:
+                    chunk = json.loads(recv_response(request_id))
+                except json.JSONDecodeError:
+                    print("Error decoding server response.")
+                    return
+                if not isinstance(chunk, dict) or "data" not in chunk:
+                    print(chunk.get("error") if isinstance(chunk, dict) else chunk)
+                    return
+                f.write(chunk["data"])
+                if not chunk["more"]:
+                    break
+        print(f"Exported {chunk['exported']} orders to {path}. Watermark: {chunk['watermark']}.")
+
+    def _set_items_enabled(self, arg, enabled):
+        if not self.logged_in:
+            print("You must login to change the menu.")
+            return
+        try:
+            item_ids = [int(item_id) for item_id in arg.split()]
+        except ValueError:
+            print("Please provide valid item IDs.")
+            return
+        if not item_ids:
+            print("Please provide at least one item ID.")
+            return
+        response = self._staff_request({"action": "set_menu_items_enabled", "item_ids": item_ids, "enabled": enabled})
+        if response is not None:
+            print(f"{'Enabled' if enabled else 'Disabled'} {response['updated']} items.")
+
+    def do_enable_items(self, arg):
+        """Make menu items available again. Usage: enable_items item_id [item_id ...] (staff only)."""
+        self._set_items_enabled(arg, True)
+
+    def do_disable_items(self, arg):
+        """Mark menu items as sold out. Usage: disable_items item_id [item_id ...] (staff only)."""
+        self._set_items_enabled(arg, False)
+
+    def do_watch_orders(self, arg):
+        """Watch pending orders live as they are placed and completed (staff only). Press Ctrl+C to stop."""
+        global _keep_events
+        if not self.logged_in:
+            print("You must login to watch orders.")
+            return
+        # Events published while the snapshot is being read arrive before the reply; keep them
+        _keep_events = True
+        try:
+            self._watch_orders()
+        finally:
+            _keep_events = False
+            _events.clear()
+
+    def _watch_orders(self):
+        response_str = send(self._staff_message({"action": "subscribe_pending_orders"}))
+        try:
+            response = json.loads(response_str)
         except json.JSONDecodeError:
             print("Error decoding server response.")
+            return
+        if isinstance(response, str):
+            print(response)
+            return
+        if "error" in response:
+            print("Error:", response["error"])
+            return
+
+        orders = {order["order_id"]: order for order in response["orders"]}
+        if orders:
+            print("Pending Orders:")
+            self._display_orders(list(orders.values()))
+        else:
+            print("No pending orders at the moment.")
+        print("Watching for new orders. Press Ctrl+C to stop.")
+        try:
+            while True:
+                # Wait in select() so Ctrl+C never lands halfway through a frame
+                if not _events:
+                    select.select([client], [], [])
+                event = json.loads(recv_event())
+                if event["event"] == "order_added":
+                    order = event["order"]
+                    orders[order["order_id"]] = order
+                    print("New order:")
+                    self._display_orders([order])
+                else:
+                    orders.pop(event["order_id"], None)
+                    status = "completed" if event["event"] == "order_completed" else "cancelled"
+                    print(f"Order {event['order_id']} {status}. {len(orders)} pending.")
+        except KeyboardInterrupt:
+            print()
+        send(self._staff_message({"action": "unsubscribe_pending_orders"}))
 
     def _display_orders(self, orders):
         table = []
         for order in orders:
             for item in order["order_details"]:
+                quantity = item.get("quantity", 1)
                 table.append([
                     order["order_id"],
                     item["item_id"],
                     item["item_name"],
-                    item["item_price"]
+                    item["item_price"],
+                    quantity,
+                    item["item_price"] * quantity
                 ])
-        headers = ["Order ID", "Item ID", "Item Name", "Item Price"]
+        headers = ["Order ID", "Item ID", "Item Name", "Item Price", "Quantity", "Line Total"]
         print(tabulate(table, headers=headers, tablefmt="fancy_grid"))
 
     def do_exit(self, arg):
@@ -214,6 +615,7 @@ class Cli(cmd.Cmd):
 
 if __name__ == "__main__":
     client.connect(ADDR)
+    negotiate()
     Cli().cmdloop()
 
 
@@ -1,29 +1,571 @@
 import sqlite3
+import datetime
 import hashlib
+import hmac
 import json
+import os
+import queue
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
 from functools import wraps
+from typing import NamedTuple
 from .constants import *
+from . import serialization
+from .archive import OrderArchive, parse_day
+from .menu_io import MENU_FORMATS, format_menu, normalize_menu_item, parse_menu
+from .order_io import ORDER_FORMATS, format_orders
+from .instrumentation import logger, metrics
 
-class DatabaseManager:
-    def __init__(self, db_path=DB_PATH):
+def compact_order_details(order_details: list) -> list:
+    """
+    Returns order lines in the compact form: one entry per item with a
+    quantity. Accepts the older per-unit form (one entry per unit, without
+    a quantity) as well, merging repeated items in first-seen order.
+    """
+    if all("quantity" in line for line in order_details) and \
+            len({line["item_id"] for line in order_details}) == len(order_details):
+        return order_details
+    lines = {}
+    for line in order_details:
+        item_id = line["item_id"]
+        if item_id in lines:
+            lines[item_id]["quantity"] += line.get("quantity", 1)
+        else:
+            lines[item_id] = {
+                "item_id": item_id,
+                "item_name": line["item_name"],
+                "item_price": line["item_price"],
+                "quantity": line.get("quantity", 1)
+            }
+    return list(lines.values())
+
+def connect(db_path: str, **kwargs) -> sqlite3.Connection:
+    """Opens a SQLite connection configured the way every connection in the app is."""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=DB_BUSY_TIMEOUT,
+        cached_statements=DB_STATEMENT_CACHE_SIZE,
+        **kwargs
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    return conn
+
+def now() -> str:
+    """Local wall-clock time in the format the order tables store."""
+    return time.strftime(TIMESTAMP_FORMAT)
+
+class GroupCommitWriter:
+    """
+    Single writer stage that owns the SQLite write connection. Callers queue a
+    function of a cursor and get a Future back; the writer runs queued
+    functions back to back in one transaction and commits once per batch, so
+    concurrent writes share one fsync. A Future resolves only after its batch
+    has committed, and a function that raises is rolled back on its own.
+    """
+    def __init__(self, db_path: str, max_batch: int = GROUP_COMMIT_MAX_BATCH,
+                 window: float = GROUP_COMMIT_WINDOW):
         self.db_path = db_path
+        self.max_batch = max_batch
+        self.window = window
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Commits everything already queued, then stops the writer thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, fn) -> Future:
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def _next_batch(self) -> tuple:
+        """Blocks for one write, then gathers more until the batch is full or the window closes."""
+        batch = []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.window
+        while item is not None:
+            batch.append(item)
+            if len(batch) >= self.max_batch:
+                break
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+        return batch, item is None
+
+    def _run(self):
+        # Transactions on this connection are managed explicitly
+        conn = connect(self.db_path, isolation_level=None)
+        # Every acknowledged write must survive a power loss; the batch shares this one fsync
+        conn.execute(f"PRAGMA synchronous={DB_WRITER_SYNCHRONOUS}")
+        cursor = conn.cursor()
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if not batch:
+                continue
+            results = []
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                for fn, future in batch:
+                    cursor.execute("SAVEPOINT write")
+                    try:
+                        results.append((future, fn(cursor), None))
+                        cursor.execute("RELEASE write")
+                    except Exception as e:
+                        cursor.execute("ROLLBACK TO write")
+                        cursor.execute("RELEASE write")
+                        results.append((future, None, e))
+                cursor.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for future, result, error in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+        conn.close()
+
+class DatabaseManager:
+    """
+    Hands out one long-lived SQLite connection per thread. Each connection is
+    configured once (WAL journal, synchronous level, statement cache) and then
+    reused for every query that thread runs. Without a db_path it opens the
+    file named by the DB_PATH_ENV environment variable, or DB_PATH.
+    """
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.environ.get(DB_PATH_ENV, DB_PATH)
+        self._local = threading.local()
+        self.writer = None
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.db_path)
+            self._local.conn = conn
+        return conn
 
     def execute(self, query: str, params: tuple = None, fetch: bool = False):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            conn.commit()
-            if fetch:
-                return cursor.fetchall()
+        conn = self._connection()
+        start = time.perf_counter()
+        try:
+            cursor = conn.execute(query, params or ())
+            rows = cursor.fetchall() if fetch else None
+            # Reads never open a transaction, so only writes pay for a commit
+            if conn.in_transaction:
+                conn.commit()
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            metrics.record_query(time.perf_counter() - start)
+        return rows
 
-class AccountManager:
-    def __init__(self, db_manager: DatabaseManager):
+    def fetch_batches(self, query: str, params: tuple = None, batch_size: int = ORDER_EXPORT_BATCH_SIZE):
+        """
+        Yields the rows of a read query in lists of up to batch_size, using
+        cursor.fetchmany so only one batch is in memory. The query runs on its
+        own connection, which reads one consistent snapshot and may be resumed
+        from any thread, and is closed when the generator finishes or is closed.
+        """
+        conn = connect(self.db_path, check_same_thread=False)
+        try:
+            cursor = conn.execute(query, params or ())
+            while True:
+                start = time.perf_counter()
+                rows = cursor.fetchmany(batch_size)
+                metrics.record_query(time.perf_counter() - start)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Yields a cursor on this thread's connection; everything run on it is
+        committed together, or rolled back if the block raises.
+        """
+        conn = self._connection()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def start_writer(self, max_batch: int = GROUP_COMMIT_MAX_BATCH, window: float = GROUP_COMMIT_WINDOW):
+        """Routes write() through a GroupCommitWriter from now on."""
+        self.writer = GroupCommitWriter(self.db_path, max_batch, window)
+        self.writer.start()
+
+    def stop_writer(self):
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+
+    def write(self, fn):
+        """
+        Runs fn(cursor) in a write transaction and returns its result once it
+        has committed. With a writer started, the write is group-committed
+        with others; otherwise it runs in a transaction on this thread.
+        """
+        start = time.perf_counter()
+        try:
+            if self.writer is not None:
+                return self.writer.submit(fn).result()
+            with self.transaction() as cursor:
+                return fn(cursor)
+        finally:
+            metrics.record_write(time.perf_counter() - start)
+
+    def close(self):
+        """Closes the calling thread's connection, if it has one."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+class ChangeLog:
+    """
+    Shares state changes between server worker processes that use the same
+    database. A worker records each change in the changes table inside the
+    transaction that made it. Every worker, the one that made a change
+    included, applies changes only through sync(), in change_id order; a
+    poller thread calls it, and so does a worker right after its own write.
+    SQLite commits one writer at a time, so change ids become visible in
+    commit order, and an order is never seen completed before it was added.
+    """
+    def __init__(self, db_manager: DatabaseManager, poll_interval: float = CHANGE_POLL_INTERVAL):
         self.db = db_manager
+        self.poll_interval = poll_interval
+        self.worker_id = None
+        self._apply = None
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.db.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+                change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                worker INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        # Workers replay only what happens after they were started
+        self.last_id = self.db.execute(f"SELECT COALESCE(MAX(change_id), 0) FROM {CHANGES_TABLE}", fetch=True)[0][0]
+
+    def record(self, cursor: sqlite3.Cursor, kind: str, payload: dict):
+        cursor.execute(
+            f"INSERT INTO {CHANGES_TABLE} (worker, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+            (self.worker_id, kind, json.dumps(payload), time.time())
+        )
+
+    def start(self, worker_id: int, apply):
+        """Starts applying every worker's changes by calling apply(kind, payload)."""
+        self.worker_id = worker_id
+        self._apply = apply
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-log", daemon=True)
+        self._thread.start()
+
+    def sync(self):
+        """Applies every change committed since the last sync, in change_id order."""
+        with self._sync_lock:
+            try:
+                rows = self.db.execute(
+                    f"SELECT change_id, kind, payload FROM {CHANGES_TABLE} WHERE change_id > ? ORDER BY change_id",
+                    (self.last_id,), fetch=True
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"[CHANGES] Could not read changes: {e}")
+                return
+            for change_id, kind, payload in rows:
+                self.last_id = change_id
+                try:
+                    self._apply(kind, json.loads(payload))
+                except Exception as e:
+                    logger.warning(f"[CHANGES] Could not apply {kind} change {change_id}: {e}")
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        last_prune = time.monotonic()
+        while not self._stop.wait(self.poll_interval):
+            self.sync()
+            # One worker trims changes every worker has long since replayed
+            if self.worker_id == 0 and time.monotonic() - last_prune >= CHANGE_LOG_RETENTION:
+                try:
+                    self.db.execute(f"DELETE FROM {CHANGES_TABLE} WHERE created_at < ?", (time.time() - CHANGE_LOG_RETENTION,))
+                except sqlite3.Error as e:
+                    logger.warning(f"[CHANGES] Could not prune changes: {e}")
+                last_prune = time.monotonic()
+        self.db.close()
+
+class OrderFeed:
+    """
+    Fans pending-order events out to subscribed staff connections. Callbacks
+    run on the publishing thread, so they must hand the event off rather
+    than block on a socket.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._next_token = 1
+
+    def subscribe(self, callback, on_drop=None) -> int:
+        """Registers callback; on_drop(token) is called if the subscriber is dropped for failing."""
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._subscribers[token] = (callback, on_drop)
+        return token
+
+    def unsubscribe(self, token: int):
+        with self._lock:
+            self._subscribers.pop(token, None)
+
+    def publish(self, event: dict):
+        with self._lock:
+            callbacks = list(self._subscribers.items())
+        for token, (callback, on_drop) in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.warning("[FEED] Dropping subscriber %s: %s", token, e)
+                self.unsubscribe(token)
+                if on_drop is not None:
+                    on_drop(token)
+
+class SalesStats:
+    """
+    Live sales and kitchen-load counters: revenue and units sold today, and
+    units still pending per item. DataManager updates them as orders change
+    state, so reading them never touches the order tables. rebuild() reloads
+    them from order_items on startup.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset_day(time.strftime("%Y-%m-%d"))
+        self.pending_orders = 0
+        self.pending_units = {}
+
+    def _reset_day(self, day: str):
+        self.day = day
+        self.revenue_today = 0.0
+        self.orders_completed_today = 0
+        self.units_sold_today = {}
+        self.revenue_by_item_today = {}
+
+    def _roll_day(self):
+        today = time.strftime("%Y-%m-%d")
+        if today != self.day:
+            self._reset_day(today)
+
+    def rebuild(self, db: "DatabaseManager"):
+        day = time.strftime("%Y-%m-%d")
+        sold = db.execute(
+            f"""
+            SELECT oi.item_id, SUM(oi.quantity), SUM(oi.quantity * oi.unit_price)
+            FROM {ORDER_ITEMS_TABLE} oi JOIN {COMPLETED_ORDERS_TABLE} c ON c.order_id = oi.order_id
+            WHERE c.completed_at >= ?
+            GROUP BY oi.item_id
+            """,
+            (day,), fetch=True
+        )
+        completed_today = db.execute(
+            f"SELECT COUNT(*) FROM {COMPLETED_ORDERS_TABLE} WHERE completed_at >= ?",
+            (day,), fetch=True
+        )[0][0]
+        pending = db.execute(
+            f"""
+            SELECT oi.item_id, SUM(oi.quantity)
+            FROM {ORDER_ITEMS_TABLE} oi JOIN {PENDING_ORDERS_TABLE} p ON p.order_id = oi.order_id
+            GROUP BY oi.item_id
+            """,
+            fetch=True
+        )
+        pending_orders = db.execute(f"SELECT COUNT(*) FROM {PENDING_ORDERS_TABLE}", fetch=True)[0][0]
+        with self._lock:
+            self._reset_day(day)
+            self.units_sold_today = {item_id: quantity for item_id, quantity, _ in sold}
+            self.revenue_by_item_today = {item_id: revenue for item_id, _, revenue in sold}
+            self.revenue_today = sum(self.revenue_by_item_today.values(), 0.0)
+            self.orders_completed_today = completed_today
+            self.pending_units = {item_id: quantity for item_id, quantity in pending}
+            self.pending_orders = pending_orders
+
+    def order_added(self, order_details: list):
+        with self._lock:
+            self.pending_orders += 1
+            for line in order_details:
+                item_id = line["item_id"]
+                self.pending_units[item_id] = self.pending_units.get(item_id, 0) + line["quantity"]
+
+    def orders_removed(self, lines: list, order_count: int, completed: bool):
+        """
+        Takes (item_id, quantity, unit_price) lines of orders leaving the
+        pending queue, counting them as sales when they were completed.
+        """
+        with self._lock:
+            self._roll_day()
+            self.pending_orders -= order_count
+            for item_id, quantity, unit_price in lines:
+                # No clamping at zero: a negative count means a removal was counted without its add
+                remaining = self.pending_units.get(item_id, 0) - quantity
+                if remaining:
+                    self.pending_units[item_id] = remaining
+                else:
+                    self.pending_units.pop(item_id, None)
+                if completed:
+                    revenue = quantity * unit_price
+                    self.units_sold_today[item_id] = self.units_sold_today.get(item_id, 0) + quantity
+                    self.revenue_by_item_today[item_id] = self.revenue_by_item_today.get(item_id, 0.0) + revenue
+                    self.revenue_today += revenue
+            if completed:
+                self.orders_completed_today += order_count
+
+    def snapshot(self, menu: list) -> dict:
+        """Returns the counters for every menu item; costs O(menu size)."""
+        with self._lock:
+            self._roll_day()
+            names = {item["item_id"]: item["item_name"] for item in menu}
+            item_ids = names.keys() | self.units_sold_today.keys() | self.pending_units.keys()
+            return {
+                "date": self.day,
+                "revenue_today": round(self.revenue_today, 2),
+                "orders_completed_today": self.orders_completed_today,
+                "pending_orders": self.pending_orders,
+                "items": [
+                    {
+                        "item_id": item_id,
+                        "item_name": names.get(item_id),
+                        "units_sold_today": self.units_sold_today.get(item_id, 0),
+                        "revenue_today": round(self.revenue_by_item_today.get(item_id, 0.0), 2),
+                        "pending_units": self.pending_units.get(item_id, 0)
+                    }
+                    for item_id in sorted(item_ids)
+                ]
+            }
+
+class MenuSnapshot(NamedTuple):
+    """
+    One cached copy of the menu. index maps each enabled item_id to its
+    (item_name, item_price); changed_at and removed_at map item ids to the
+    menu version that last changed or removed them, and version is the
+    newest of those.
+    """
+    items: list
+    encoded: bytes
+    index: dict
+    version: int
+    changed_at: dict
+    removed_at: dict
+
+class Session:
+    """
+    State that belongs to one client connection: who is logged in and the
+    order waiting for payment. Keeping it per connection lets clients order,
+    pay and log in concurrently without seeing each other's state.
+    """
+    def __init__(self):
         self.logged_in = False
         self.user_id = None
+        self.last_order = None
+
+class TokenCache:
+    """
+    In-memory map of live session tokens to user ids with a TTL. Entries
+    expire on lookup, and the least recently used one is evicted once the
+    cache is full. Logged-out tokens are remembered as revoked until they
+    would have expired, so their signature alone cannot bring them back.
+    """
+    def __init__(self, ttl: float = TOKEN_TTL, max_size: int = TOKEN_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._revoked = {}
+
+    def put(self, token: str, user_id: int, expires_at: float):
+        with self._lock:
+            self._entries[token] = (user_id, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry[0]
+
+    def discard(self, token: str):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def revoke(self, token: str, expires_at: float):
+        with self._lock:
+            self._entries.pop(token, None)
+            now = time.time()
+            for revoked in [revoked for revoked, until in self._revoked.items() if until <= now]:
+                del self._revoked[revoked]
+            if expires_at > now:
+                self._revoked[token] = expires_at
+
+    def is_revoked(self, token: str) -> bool:
+        with self._lock:
+            return token in self._revoked
+
+class AccountManager:
+    def __init__(self, db_manager: DatabaseManager):
+        self.db = db_manager
+        # Tokens signed with a per-process key stop working on restart unless
+        # SMARTSERVE_SECRET pins the key
+        secret = os.environ.get(SECRET_KEY_ENV)
+        self._secret = secret.encode(FORMAT) if secret else secrets.token_bytes(32)
+        self.tokens = TokenCache()
+        # Set when several worker processes share the database
+        self.changes = None
         self._initialize_db()
 
     def _initialize_db(self):
@@ -37,8 +579,19 @@ class AccountManager:
             """
         )
 
-    def _hash_password(self, password: str) -> str:
-        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    def _hash_password(self, password: str, salt: bytes = None) -> str:
+        salt = salt or secrets.token_bytes(16)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(FORMAT), salt, PASSWORD_HASH_ITERATIONS)
+        return f"pbkdf2_sha256${PASSWORD_HASH_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+    def _verify_password(self, password: str, password_hash: str) -> bool:
+        if "$" not in password_hash:
+            # Accounts created before salted hashing store a bare SHA-256 digest
+            legacy = hashlib.sha256(password.encode(FORMAT)).hexdigest()
+            return hmac.compare_digest(legacy, password_hash)
+        _, iterations, salt, digest = password_hash.split("$")
+        candidate = hashlib.pbkdf2_hmac("sha256", password.encode(FORMAT), bytes.fromhex(salt), int(iterations))
+        return hmac.compare_digest(candidate.hex(), digest)
 
     def create_account(self, email: str, password: str) -> bool:
         try:
@@ -50,29 +603,109 @@ class AccountManager:
         except sqlite3.IntegrityError:
             return False
 
-    def login(self, email: str, password: str) -> bool:
+    def _authenticate(self, email: str, password: str):
+        """Returns the user_id for valid credentials, otherwise None."""
         result = self.db.execute(
             f"SELECT user_id, password_hash FROM {USER_TABLE} WHERE email_id = ?",
             (email,), fetch=True
         )
-        if result and result[0][1] == self._hash_password(password):
-            self.logged_in = True
-            self.user_id = result[0][0]
-            return True
-        return False
+        if not result or not self._verify_password(password, result[0][1]):
+            return None
+        user_id, password_hash = result[0]
+        if "$" not in password_hash:
+            self.db.execute(
+                f"UPDATE {USER_TABLE} SET password_hash = ? WHERE user_id = ?",
+                (self._hash_password(password), user_id)
+            )
+        return user_id
 
-    def logout(self):
-        self.logged_in = False
-        self.user_id = None
+    def _sign(self, payload: str) -> str:
+        return hmac.new(self._secret, payload.encode(FORMAT), hashlib.sha256).hexdigest()
+
+    def issue_token(self, user_id: int) -> str:
+        """Returns a signed session token for user_id, valid for the cache TTL."""
+        expires_at = int(time.time() + self.tokens.ttl)
+        payload = f"{user_id}.{expires_at}.{secrets.token_hex(8)}"
+        token = f"{payload}.{self._sign(payload)}"
+        self.tokens.put(token, user_id, expires_at)
+        return token
+
+    def resolve_token(self, token: str):
+        """
+        Returns the user_id a token was issued to, or None if it is invalid or
+        expired. Cached tokens cost a dict lookup; others are checked against
+        their signature once and then cached.
+        """
+        if not isinstance(token, str):
+            return None
+        user_id = self.tokens.get(token)
+        if user_id is not None:
+            return user_id
+        if self.tokens.is_revoked(token):
+            return None
+        verified = self._verify_token(token)
+        if verified is None:
+            return None
+        user_id, expires_at = verified
+        self.tokens.put(token, user_id, expires_at)
+        return user_id
+
+    def _verify_token(self, token: str):
+        """Returns (user_id, expires_at) for an unexpired token with a valid signature, otherwise None."""
+        try:
+            payload, signature = token.rsplit(".", 1)
+            user_id, expires_at, _ = payload.split(".")
+            user_id, expires_at = int(user_id), int(expires_at)
+        except ValueError:
+            return None
+        if expires_at <= time.time() or not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        return user_id, expires_at
+
+    def revoke_token(self, token: str):
+        """
+        Revokes a token until it expires, in every worker process when they
+        share the database.
+        """
+        verified = self._verify_token(token) if isinstance(token, str) else None
+        if verified is None:
+            return
+        self.tokens.revoke(token, verified[1])
+        if self.changes is not None:
+            payload = {"token": token, "expires_at": verified[1]}
+            self.db.write(lambda cursor: self.changes.record(cursor, "token_revoked", payload))
+
+    def login(self, session: Session, email: str, password: str):
+        """Logs the session in and returns a session token, or None for bad credentials."""
+        user_id = self._authenticate(email, password)
+        if user_id is None:
+            return None
+        session.logged_in = True
+        session.user_id = user_id
+        return self.issue_token(user_id)
+
+    def resume(self, session: Session, token: str) -> bool:
+        """Logs the session in from a token returned by an earlier login."""
+        user_id = self.resolve_token(token)
+        if user_id is None:
+            return False
+        session.logged_in = True
+        session.user_id = user_id
+        return True
+
+    def logout(self, session: Session, token: str = None):
+        session.logged_in = False
+        session.user_id = None
+        if token is not None:
+            self.revoke_token(token)
 
     def delete_account(self, email: str, password: str) -> bool:
-        if not self.login(email, password):
+        if self._authenticate(email, password) is None:
             return False
         self.db.execute(
             f"DELETE FROM {USER_TABLE} WHERE email_id = ?",
             (email,)
         )
-        self.logout()
         return True
 
 class DataManager:
@@ -80,7 +713,15 @@ class DataManager:
         self.am = account_manager
         self.db = account_manager.db
         self._initialize_db()
-        self._last_order = None
+        self.feed = OrderFeed()
+        self._menu_lock = threading.Lock()
+        self._menu_version = 0
+        self._menu_cache = None
+        self.stats = SalesStats()
+        self.stats.rebuild(self.db)
+        # Set when several worker processes share the database
+        self.changes = None
+        self.archive = OrderArchive(os.path.join(os.path.dirname(self.db.db_path), ARCHIVE_DIR_NAME))
 
     def _initialize_db(self):
         self.db.execute(
@@ -89,6 +730,7 @@ class DataManager:
                 order_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
                 order_details TEXT NOT NULL,
+                created_at TEXT,
                 FOREIGN KEY (user_id) REFERENCES {USER_TABLE}(user_id)
             )
             """
@@ -99,6 +741,9 @@ class DataManager:
                 order_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
                 order_details TEXT NOT NULL,
+                created_at TEXT,
+                completed_at TEXT,
+                completion_seq INTEGER,
                 FOREIGN KEY (user_id) REFERENCES {USER_TABLE}(user_id)
             )
             """
@@ -109,44 +754,281 @@ class DataManager:
                 item_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 item_name TEXT NOT NULL,
                 item_price REAL NOT NULL,
-                enabled BOOLEAN NOT NULL DEFAULT 1
+                enabled BOOLEAN NOT NULL DEFAULT 1,
+                version INTEGER NOT NULL DEFAULT 0
             )
             """
         )
+        self._create_menu_tombstones_table()
+        self._create_order_items_table()
+        self.db.execute(
+            f"CREATE TABLE IF NOT EXISTS {SETTINGS_TABLE} (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._migrate()
+        self.menu_epoch = self._load_menu_epoch()
+
+    def _load_menu_epoch(self) -> str:
+        """
+        Returns this database's menu epoch, a random id made when the database
+        is created. Menu versions are only comparable within one epoch, so a
+        client's cached version cannot match a recreated database or another server.
+        """
+        self.db.execute(
+            f"INSERT OR IGNORE INTO {SETTINGS_TABLE} (key, value) VALUES (?, ?)",
+            (MENU_EPOCH_KEY, secrets.token_hex(8))
+        )
+        return self.db.execute(
+            f"SELECT value FROM {SETTINGS_TABLE} WHERE key = ?", (MENU_EPOCH_KEY,), fetch=True
+        )[0][0]
+
+    def _create_order_items_table(self):
+        # One row per (order, item), for both pending and completed orders;
+        # join against either orders table to tell which state an order is in
+        self.db.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {ORDER_ITEMS_TABLE} (
+                order_id INTEGER NOT NULL,
+                item_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                unit_price REAL NOT NULL,
+                PRIMARY KEY (order_id, item_id)
+            ) WITHOUT ROWID
+            """
+        )
+        self.db.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{ORDER_ITEMS_TABLE}_item ON {ORDER_ITEMS_TABLE} (item_id, order_id)"
+        )
+
+    def _migrate(self):
+        """
+        Brings existing databases up to the current schema. Each step runs
+        once; PRAGMA user_version records the last step applied.
+        """
+        version = self.db.execute("PRAGMA user_version", fetch=True)[0][0]
+        if version < 1:
+            self._migrate_compact_order_details()
+            self.db.execute("PRAGMA user_version = 1")
+        if version < 2:
+            self._migrate_backfill_order_items()
+            self.db.execute("PRAGMA user_version = 2")
+        if version < 3:
+            self._migrate_order_timestamps()
+            self.db.execute("PRAGMA user_version = 3")
+        if version < 4:
+            self._migrate_menu_versions()
+            self.db.execute("PRAGMA user_version = 4")
+        if version < 5:
+            self._migrate_completion_seq()
+            self.db.execute("PRAGMA user_version = 5")
+
+    def _migrate_compact_order_details(self):
+        with self.db.transaction() as cursor:
+            for table in (PENDING_ORDERS_TABLE, COMPLETED_ORDERS_TABLE):
+                rows = cursor.execute(f"SELECT order_id, order_details FROM {table}").fetchall()
+                cursor.executemany(
+                    f"UPDATE {table} SET order_details = ? WHERE order_id = ?",
+                    [(json.dumps(compact_order_details(json.loads(details))), order_id)
+                     for order_id, details in rows]
+                )
+
+    def _migrate_backfill_order_items(self):
+        with self.db.transaction() as cursor:
+            for table in (PENDING_ORDERS_TABLE, COMPLETED_ORDERS_TABLE):
+                rows = cursor.execute(f"SELECT order_id, order_details FROM {table}").fetchall()
+                for order_id, details in rows:
+                    self._insert_order_items(cursor, order_id, json.loads(details))
+
+    def _migrate_order_timestamps(self):
+        # Tables created before timestamps existed gain the columns; their old rows stay NULL
+        columns = {
+            PENDING_ORDERS_TABLE: ("created_at",),
+            COMPLETED_ORDERS_TABLE: ("created_at", "completed_at")
+        }
+        for table, names in columns.items():
+            existing = {row[1] for row in self.db.execute(f"PRAGMA table_info({table})", fetch=True)}
+            for name in names:
+                if name not in existing:
+                    self.db.execute(f"ALTER TABLE {table} ADD COLUMN {name} TEXT")
+        self.db.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{COMPLETED_ORDERS_TABLE}_completed_at ON {COMPLETED_ORDERS_TABLE} (completed_at)"
+        )
+
+    def _migrate_menu_versions(self):
+        # Existing items all start at menu version 0
+        existing = {row[1] for row in self.db.execute(f"PRAGMA table_info({MENU_TABLE})", fetch=True)}
+        if "version" not in existing:
+            self.db.execute(f"ALTER TABLE {MENU_TABLE} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    def _migrate_completion_seq(self):
+        # Orders completed before the sequence existed are numbered in completion order
+        existing = {row[1] for row in self.db.execute(f"PRAGMA table_info({COMPLETED_ORDERS_TABLE})", fetch=True)}
+        with self.db.transaction() as cursor:
+            if "completion_seq" not in existing:
+                cursor.execute(f"ALTER TABLE {COMPLETED_ORDERS_TABLE} ADD COLUMN completion_seq INTEGER")
+            cursor.execute(
+                f"""
+                UPDATE {COMPLETED_ORDERS_TABLE} SET completion_seq = (
+                    SELECT seq FROM (
+                        SELECT order_id, ROW_NUMBER() OVER (ORDER BY completed_at, order_id) AS seq
+                        FROM {COMPLETED_ORDERS_TABLE}
+                    ) numbered WHERE numbered.order_id = {COMPLETED_ORDERS_TABLE}.order_id
+                )
+                """
+            )
+            cursor.execute(
+                f"""
+                INSERT OR REPLACE INTO {SETTINGS_TABLE} (key, value)
+                SELECT ?, COALESCE(MAX(completion_seq), 0) FROM {COMPLETED_ORDERS_TABLE}
+                """,
+                (COMPLETION_SEQ_KEY,)
+            )
+        self.db.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{COMPLETED_ORDERS_TABLE}_completion_seq ON {COMPLETED_ORDERS_TABLE} (completion_seq)"
+        )
+
+    @staticmethod
+    def _take_completion_seqs(cursor, count: int) -> int:
+        """
+        Reserves count completion sequence numbers and returns the one before
+        the first. The counter lives in the settings table, so archiving
+        completed orders never lets a number be handed out twice.
+        """
+        last = cursor.execute(
+            f"SELECT CAST(value AS INTEGER) FROM {SETTINGS_TABLE} WHERE key = ?", (COMPLETION_SEQ_KEY,)
+        ).fetchone()
+        last = last[0] if last else 0
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {SETTINGS_TABLE} (key, value) VALUES (?, ?)",
+            (COMPLETION_SEQ_KEY, last + count)
+        )
+        return last
+
+    def _create_menu_tombstones_table(self):
+        # Remembers the menu version each item was removed at, so diffs can report removals
+        self.db.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {MENU_TOMBSTONES_TABLE} (
+                item_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+            """
+        )
+
+    @staticmethod
+    def _insert_order_items(cursor, order_id: int, order_details: list):
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {ORDER_ITEMS_TABLE} (order_id, item_id, quantity, unit_price) VALUES (?, ?, ?, ?)",
+            [(order_id, line["item_id"], line["quantity"], line["item_price"]) for line in order_details]
+        )
 
     def staff_only(func):
         @wraps(func)
-        def wrapper(self, *args, **kwargs):
-            if self.am.logged_in:
-                return func(self, *args, **kwargs)
+        def wrapper(self, session, *args, **kwargs):
+            if session.logged_in:
+                return func(self, session, *args, **kwargs)
             else:
                 return "Access Denied: Staff Only Operation"
         return wrapper
 
+    def _load_menu(self) -> "MenuSnapshot":
+        """
+        Returns the cached MenuSnapshot, rebuilding it from the database only
+        after a menu mutation has invalidated it.
+        """
+        cache = self._menu_cache
+        if cache is not None:
+            return cache
+        with self._menu_lock:
+            if self._menu_cache is not None:
+                return self._menu_cache
+            version = self._menu_version
+            rows = self.db.execute(
+                f"SELECT item_id, item_name, item_price, enabled, version FROM {MENU_TABLE}",
+                fetch=True
+            )
+            removed_at = dict(self.db.execute(
+                f"SELECT item_id, version FROM {MENU_TOMBSTONES_TABLE}", fetch=True
+            ))
+            items = [
+                {
+                    "item_id": row[0],
+                    "item_name": row[1],
+                    "item_price": row[2],
+                    "enabled": bool(row[3])
+                }
+                for row in rows
+            ]
+            index = {item["item_id"]: (item["item_name"], item["item_price"]) for item in items if item["enabled"]}
+            changed_at = {row[0]: row[4] for row in rows}
+            cache = MenuSnapshot(
+                items=items,
+                encoded=serialization.dumps(items),
+                index=index,
+                version=max([0, *changed_at.values(), *removed_at.values()]),
+                changed_at=changed_at,
+                removed_at=removed_at
+            )
+            # A mutation that landed while we were reading makes this copy stale
+            if version == self._menu_version:
+                self._menu_cache = cache
+            return cache
+
+    def _invalidate_menu(self):
+        with self._menu_lock:
+            self._menu_version += 1
+            self._menu_cache = None
+
     def get_menu(self):
-        rows = self.db.execute(
-            f"SELECT item_id, item_name, item_price, enabled FROM {MENU_TABLE}",
-            fetch=True
-        )
-        return [
-            {
-                "item_id": row[0],
-                "item_name": row[1],
-                "item_price": row[2],
-                "enabled": bool(row[3])
-            }
-            for row in rows
-        ]
+        return self._load_menu().items
 
-    def create_order(self, order_json_str: str) -> dict:
-        try:
-            order_data = json.loads(order_json_str)
-        except json.JSONDecodeError:
-            return {"error": "Invalid JSON"}
+    def get_menu_encoded(self) -> bytes:
+        """Returns the menu as ready-to-send JSON bytes."""
+        return self._load_menu().encoded
+
+    def get_menu_since(self, version: int, epoch: str = None) -> dict:
+        """
+        Returns only what changed after menu version `version` of `epoch`:
+        not_modified when nothing did, otherwise the changed items and removed
+        item ids. A version from another epoch, or one the server never
+        issued, gets the full menu instead.
+        """
+        menu = self._load_menu()
+        if epoch != self.menu_epoch:
+            return {"epoch": self.menu_epoch, "version": menu.version, "menu": menu.items}
+        if version == menu.version:
+            return {"epoch": epoch, "version": menu.version, "not_modified": True}
+        if not isinstance(version, int) or not 0 <= version < menu.version:
+            return {"epoch": epoch, "version": menu.version, "menu": menu.items}
+        return {
+            "epoch": epoch,
+            "version": menu.version,
+            "changed": [item for item in menu.items if menu.changed_at[item["item_id"]] > version],
+            "removed": [item_id for item_id, removed in menu.removed_at.items() if removed > version]
+        }
+
+    @staticmethod
+    def _next_menu_version(cursor) -> int:
+        return cursor.execute(
+            f"""
+            SELECT COALESCE(MAX(version), 0) + 1 FROM (
+                SELECT MAX(version) AS version FROM {MENU_TABLE}
+                UNION ALL SELECT MAX(version) FROM {MENU_TOMBSTONES_TABLE}
+            )
+            """
+        ).fetchone()[0]
 
+    def _price_order(self, order_data: list, menu_index: dict):
+        """
+        Validates one order against the menu index and returns its
+        (order_details, total_price), or an error dict.
+        """
+        if not isinstance(order_data, list) or not order_data:
+            return {"error": "Invalid item format"}
         item_ids = []
         quantities = []
         for item in order_data:
+            if not isinstance(item, dict):
+                return {"error": "Invalid item format"}
             keys = list(item.keys())
             if len(keys) != 2:
                 return {"error": "Invalid item format"}
@@ -158,65 +1040,109 @@ class DataManager:
             quantity = item[qty_key[0]]
             if not isinstance(item_id, int) or not isinstance(quantity, int):
                 return {"error": "Item id and quantity must be integers"}
+            if quantity < 1:
+                return {"error": "Quantity must be at least 1"}
             item_ids.append(item_id)
             quantities.append(quantity)
 
-        # Check availability of requested items: set for uniqueness
-        placeholders = ",".join("?" for _ in item_ids)
-        menu_items = self.db.execute(
-            f"SELECT item_id, item_name, item_price FROM {MENU_TABLE} WHERE item_id IN ({placeholders}) AND enabled = 1",
-            tuple(set(item_ids)),
-            fetch=True
-        )
-
-        enabled_ids = {row[0] for row in menu_items}
-        requested_ids = set(item_ids)
-        if not requested_ids.issubset(enabled_ids):
+        # Every requested item must be on the menu and enabled
+        if any(item_id not in menu_index for item_id in item_ids):
             return {"error": "Some items are not available or disabled"}
 
         total_price = 0
         order_details = []
         for item_id, quantity in zip(item_ids, quantities):
-            item = next((row for row in menu_items if row[0] == item_id), None)
-            if item:
-                _, name, price = item
-                total_price += price * quantity
-                for _ in range(quantity):
-                    order_details.append({"item_id": item_id, "item_name": name, "item_price": price})
-
-        self._last_order = {
-            "user_id": None,
-            "order_details": json.dumps(order_details),
+            name, price = menu_index[item_id]
+            total_price += price * quantity
+            order_details.append({"item_id": item_id, "item_name": name, "item_price": price, "quantity": quantity})
+        return compact_order_details(order_details), total_price
+
+    def create_order(self, session: Session, order_data: list) -> dict:
+        priced = self._price_order(order_data, self._load_menu().index)
+        if isinstance(priced, dict):
+            return priced
+        order_details, total_price = priced
+
+        session.last_order = {
+            "user_id": session.user_id,
+            "order_details": order_details,
             "total_price": total_price,
             "payment_link": "http://mockpaymentgateway.com/pay/12345"
         }
         return {
             "total_price": total_price,
-            "payment_link": self._last_order["payment_link"],
+            "payment_link": session.last_order["payment_link"],
             "order_details": order_details
         }
 
-    def payment_complete(self) -> dict:
-        if not self._last_order:
+    def payment_complete(self, session: Session) -> dict:
+        if not session.last_order:
             return {"error": "No order to complete"}
-        order = self._last_order
-        with sqlite3.connect(self.db.db_path) as conn:
-            cursor = conn.cursor()
+        order = session.last_order
+        order_details_json = json.dumps(order["order_details"])
+
+        def insert(cursor):
             cursor.execute(
-                f"INSERT INTO {PENDING_ORDERS_TABLE} (user_id, order_details) VALUES (?, ?)",
-                (order["user_id"], order["order_details"])
+                f"INSERT INTO {PENDING_ORDERS_TABLE} (user_id, order_details, created_at) VALUES (?, ?, ?)",
+                (order["user_id"], order_details_json, now())
             )
             order_id = cursor.lastrowid
-            conn.commit()
-        self._last_order = None
+            self._insert_order_items(cursor, order_id, order["order_details"])
+            self._record_change(cursor, "orders_added", {"orders": [[order_id, order["order_details"]]]})
+            return order_id
+
+        order_id = self.db.write(insert)
+        session.last_order = None
+        self._apply_written("orders_added", {"orders": [[order_id, order["order_details"]]]})
         return {
             "order_id": order_id,
             "total_price": order["total_price"],
-            "items_ordered": json.loads(order["order_details"]),
+            "items_ordered": order["order_details"],
         }
 
     @staff_only
-    def get_pending_orders(self):
+    def create_orders_bulk(self, session: Session, orders: list) -> dict:
+        """
+        Prices a batch of already-paid orders and inserts every valid one in a
+        single transaction. Results are returned in request order, each either
+        the placed order or the error that rejected it.
+        """
+        if not isinstance(orders, list):
+            return {"error": "orders must be a list"}
+        menu_index = self._load_menu().index
+        results = []
+        placed = []
+        for order_data in orders:
+            priced = self._price_order(order_data, menu_index)
+            if isinstance(priced, dict):
+                results.append(priced)
+                continue
+            order_details, total_price = priced
+            result = {"order_id": None, "total_price": total_price, "items_ordered": order_details}
+            results.append(result)
+            placed.append(result)
+        def insert_all(cursor):
+            created_at = now()
+            for result in placed:
+                cursor.execute(
+                    f"INSERT INTO {PENDING_ORDERS_TABLE} (user_id, order_details, created_at) VALUES (?, ?, ?)",
+                    (None, json.dumps(result["items_ordered"]), created_at)
+                )
+                result["order_id"] = cursor.lastrowid
+                self._insert_order_items(cursor, result["order_id"], result["items_ordered"])
+            self._record_change(cursor, "orders_added", {
+                "orders": [[result["order_id"], result["items_ordered"]] for result in placed]
+            })
+
+        if placed:
+            self.db.write(insert_all)
+            self._apply_written("orders_added", {
+                "orders": [[result["order_id"], result["items_ordered"]] for result in placed]
+            })
+        return {"placed": len(placed), "results": results}
+
+    @staff_only
+    def get_pending_orders(self, session: Session):
         rows = self.db.execute(
             f"SELECT order_id, order_details FROM {PENDING_ORDERS_TABLE}",
             fetch=True
@@ -224,73 +1150,559 @@ class DataManager:
         return [
             {
                 "order_id": row[0],
-                "order_details": json.loads(row[1])
+                "order_details": compact_order_details(serialization.loads(row[1]))
             }
             for row in rows
         ]
 
+    def _move_orders(self, order_ids: list, status: bool) -> list:
+        """
+        Moves pending orders to completed (or drops them when status is false)
+        in one transaction and returns the ids that were actually pending.
+        """
+        def move(cursor):
+            moved = []
+            completed_at = now()
+            for start in range(0, len(order_ids), SQL_IN_CHUNK_SIZE):
+                chunk = order_ids[start:start + SQL_IN_CHUNK_SIZE]
+                placeholders = ",".join("?" for _ in chunk)
+                rows = cursor.execute(
+                    f"SELECT order_id FROM {PENDING_ORDERS_TABLE} WHERE order_id IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                if not rows:
+                    continue
+                pending_ids = [row[0] for row in rows]
+                pending_placeholders = ",".join("?" for _ in pending_ids)
+                lines.extend(cursor.execute(
+                    f"SELECT item_id, quantity, unit_price FROM {ORDER_ITEMS_TABLE} WHERE order_id IN ({pending_placeholders})",
+                    pending_ids
+                ).fetchall())
+                if status:
+                    # completion_seq rises with every completion, whatever the order ids, so exports can resume from it
+                    cursor.execute(
+                        f"""
+                        INSERT INTO {COMPLETED_ORDERS_TABLE}
+                            (order_id, user_id, order_details, created_at, completed_at, completion_seq)
+                        SELECT order_id, user_id, order_details, created_at, ?, ? + ROW_NUMBER() OVER (ORDER BY order_id)
+                        FROM {PENDING_ORDERS_TABLE}
+                        WHERE order_id IN ({placeholders})
+                        """,
+                        (completed_at, self._take_completion_seqs(cursor, len(rows)), *chunk)
+                    )
+                else:
+                    # Cancelled orders leave no trace in the item totals
+                    # Only orders that were still pending; a completed order keeps its lines
+                    cursor.execute(
+                        f"DELETE FROM {ORDER_ITEMS_TABLE} WHERE order_id IN ({pending_placeholders})",
+                        pending_ids
+                    )
+                cursor.execute(
+                    f"DELETE FROM {PENDING_ORDERS_TABLE} WHERE order_id IN ({placeholders})",
+                    chunk
+                )
+                moved.extend(pending_ids)
+            if moved:
+                self._record_change(cursor, "orders_moved", {"order_ids": moved, "lines": lines, "status": status})
+            return moved
+
+        lines = []
+        moved = self.db.write(move)
+        if moved:
+            self._apply_written("orders_moved", {"order_ids": moved, "lines": lines, "status": status})
+        return moved
+
+    def _orders_added(self, orders: list):
+        """Counts newly placed (order_id, order_details) orders and announces them to the feed."""
+        for order_id, order_details in orders:
+            self.stats.order_added(order_details)
+            self.feed.publish({
+                "event": "order_added",
+                "order": {"order_id": order_id, "order_details": order_details}
+            })
+
+    def _orders_moved(self, order_ids: list, lines: list, status: bool):
+        self.stats.orders_removed(lines, len(order_ids), status)
+        event = "order_completed" if status else "order_cancelled"
+        for order_id in order_ids:
+            self.feed.publish({"event": event, "order_id": order_id})
+
+    def _record_change(self, cursor: sqlite3.Cursor, kind: str, payload: dict):
+        """Logs a change for the other worker processes, inside the write that made it."""
+        if self.changes is not None:
+            self.changes.record(cursor, kind, payload)
+
+    def _apply_written(self, kind: str, payload: dict):
+        """
+        Applies a committed change to the caches, stats and feed: at once in a
+        single process, or through the change log when workers share the
+        database, so each worker sees every change in commit order.
+        """
+        if self.changes is None:
+            self.apply_change(kind, payload)
+        else:
+            self.changes.sync()
+
+    def apply_change(self, kind: str, payload: dict):
+        """Applies a committed change, made by this or another worker, to this process's caches and feed."""
+        if kind == "menu_changed":
+            self._invalidate_menu()
+        elif kind == "orders_added":
+            self._orders_added(payload["orders"])
+        elif kind == "orders_moved":
+            self._orders_moved(payload["order_ids"], payload["lines"], payload["status"])
+        elif kind == "token_revoked":
+            self.am.tokens.revoke(payload["token"], payload["expires_at"])
+
     @staff_only
-    def set_order_complete(self, order_id: int, status: bool):
-        row = self.db.execute(
-            f"SELECT user_id, order_details FROM {PENDING_ORDERS_TABLE} WHERE order_id = ?",
-            (order_id,), fetch=True
-        )
-        if not row:
+    def set_order_complete(self, session: Session, order_id: int, status: bool):
+        if not self._move_orders([order_id], status):
             return "Order not found"
-        user_id, order_details = row[0]
-        self.db.execute(
-            f"DELETE FROM {PENDING_ORDERS_TABLE} WHERE order_id = ?",
-            (order_id,)
+        return self.get_pending_orders(session)
+
+    @staff_only
+    def complete_orders(self, session: Session, order_ids: list, status: bool = True) -> dict:
+        """
+        Completes (or cancels, when status is false) many pending orders in a
+        single transaction. Only the ids that were moved are returned.
+        """
+        if not isinstance(order_ids, list) or not all(isinstance(order_id, int) for order_id in order_ids):
+            return {"error": "order_ids must be a list of integers"}
+        order_ids = list(dict.fromkeys(order_ids))
+        moved = self._move_orders(order_ids, bool(status))
+        moved_set = set(moved)
+        return {
+            "status": "completed" if status else "cancelled",
+            "order_ids": moved,
+            "not_found": [order_id for order_id in order_ids if order_id not in moved_set]
+        }
+
+    @staff_only
+    def subscribe_pending_orders(self, session: Session, callback, on_drop=None):
+        """
+        Registers callback for order events and returns (token, snapshot).
+        The subscription starts before the snapshot is read, so an order can
+        show up in both; subscribers should key orders by order_id. on_drop
+        is called with the token if the subscriber stalls and is dropped.
+        """
+        token = self.feed.subscribe(callback, on_drop)
+        return token, self.get_pending_orders(session)
+
+    def unsubscribe_pending_orders(self, token: int):
+        self.feed.unsubscribe(token)
+
+    @staff_only
+    def get_completed_orders(self, session: Session, start_date: str = None, end_date: str = None):
+        """
+        Without dates, returns the completed orders still in the database.
+        With a date range (YYYY-MM-DD, inclusive, either end optional), also
+        reads the archive partitions for the days in range, and each order
+        carries its completed_at.
+        """
+        if start_date is None and end_date is None:
+            rows = self.db.execute(
+                f"SELECT order_id, order_details FROM {COMPLETED_ORDERS_TABLE}",
+                fetch=True
+            )
+            return [
+                {
+                    "order_id": row[0],
+                    "order_details": compact_order_details(serialization.loads(row[1]))
+                }
+                for row in rows
+            ]
+        try:
+            start_day = parse_day(start_date).isoformat() if start_date is not None else "0000-00-00"
+            end_day = parse_day(end_date).isoformat() if end_date is not None else "9999-99-99"
+        except ValueError:
+            return {"error": "start_date and end_date must be YYYY-MM-DD dates"}
+        rows = self.db.execute(
+            f"""
+            SELECT order_id, order_details, completed_at FROM {COMPLETED_ORDERS_TABLE}
+            WHERE completed_at >= ? AND completed_at < ?
+            """,
+            (start_day, end_day + "~"), fetch=True  # "~" sorts after any time of day
         )
-        if status:
-            self.db.execute(
-                f"INSERT INTO {COMPLETED_ORDERS_TABLE} (order_id, user_id, order_details) VALUES (?, ?, ?)",
-                (order_id, user_id, order_details)
+        # A partition is written before the archiving transaction commits, so
+        # an order can be in both places after a failed commit; keep one copy
+        orders = {
+            order["order_id"]: {key: order[key] for key in ("order_id", "order_details", "completed_at")}
+            for order in self.archive.query(start_day, end_day)
+        }
+        orders.update(
+            (row[0], {
+                "order_id": row[0],
+                "order_details": compact_order_details(serialization.loads(row[1])),
+                "completed_at": row[2]
+            })
+            for row in rows
+        )
+        return sorted(orders.values(), key=lambda order: (order["completed_at"], order["order_id"]))
+
+    def _archive_completed_orders(self, retention_days: int = ARCHIVE_RETENTION_DAYS) -> dict:
+        """
+        Moves completed orders from before the last retention_days days into
+        the archive, one day partition per transaction. Their order_items rows
+        go with them, so item totals cover the orders still in the database.
+        """
+        cutoff = (datetime.date.today() - datetime.timedelta(days=retention_days)).isoformat()
+        days = [
+            row[0] for row in self.db.execute(
+                f"""
+                SELECT DISTINCT substr(completed_at, 1, 10) FROM {COMPLETED_ORDERS_TABLE}
+                WHERE completed_at < ? ORDER BY 1
+                """,
+                (cutoff,), fetch=True
             )
-        return self.get_pending_orders()
+        ]
+
+        def archive_day(day):
+            def move(cursor):
+                # The partition is written while this transaction holds the write
+                # lock, so concurrent archivers in other workers cannot interleave
+                rows = cursor.execute(
+                    f"""
+                    SELECT order_id, user_id, order_details, created_at, completed_at
+                    FROM {COMPLETED_ORDERS_TABLE} WHERE completed_at >= ? AND completed_at < ?
+                    """,
+                    (day, day + "~")
+                ).fetchall()
+                if not rows:
+                    return 0
+                self.archive.write(day, [
+                    {
+                        "order_id": row[0],
+                        "user_id": row[1],
+                        "order_details": compact_order_details(serialization.loads(row[2])),
+                        "created_at": row[3],
+                        "completed_at": row[4]
+                    }
+                    for row in rows
+                ])
+                order_ids = [row[0] for row in rows]
+                for start in range(0, len(order_ids), SQL_IN_CHUNK_SIZE):
+                    chunk = order_ids[start:start + SQL_IN_CHUNK_SIZE]
+                    placeholders = ",".join("?" for _ in chunk)
+                    cursor.execute(f"DELETE FROM {ORDER_ITEMS_TABLE} WHERE order_id IN ({placeholders})", chunk)
+                    cursor.execute(f"DELETE FROM {COMPLETED_ORDERS_TABLE} WHERE order_id IN ({placeholders})", chunk)
+                return len(rows)
+            return self.db.write(move)
+
+        archived = {day: archive_day(day) for day in days}
+        return {"archived": sum(archived.values()), "days": [day for day, count in archived.items() if count]}
 
     @staff_only
-    def get_completed_orders(self):
+    def archive_completed_orders(self, session: Session, retention_days: int = ARCHIVE_RETENTION_DAYS) -> dict:
+        if not isinstance(retention_days, int) or retention_days < 0:
+            return {"error": "retention_days must be a non-negative integer"}
+        return self._archive_completed_orders(retention_days)
+
+    def _order_page(self, table: str, after_id: int, limit: int) -> dict:
         rows = self.db.execute(
-            f"SELECT order_id, order_details FROM {COMPLETED_ORDERS_TABLE}",
-            fetch=True
+            f"SELECT order_id, order_details FROM {table} WHERE order_id > ? ORDER BY order_id LIMIT ?",
+            (after_id, limit), fetch=True
         )
-        return [
+        orders = [
             {
                 "order_id": row[0],
-                "order_details": json.loads(row[1])
+                "order_details": compact_order_details(serialization.loads(row[1]))
             }
             for row in rows
         ]
+        return {
+            "orders": orders,
+            "next_after_id": orders[-1]["order_id"] if orders else after_id,
+            "more": len(orders) == limit
+        }
 
     @staff_only
-    def add_menu_item(self, item_name: str, price: float):
-        self.db.execute(
-            f"INSERT INTO {MENU_TABLE} (item_name, item_price, enabled) VALUES (?, ?, 1)",
-            (item_name, price)
+    def get_pending_orders_page(self, session: Session, after_id: int = 0, limit: int = ORDER_PAGE_SIZE) -> dict:
+        """Returns up to limit pending orders with order_id > after_id."""
+        return self._order_page(PENDING_ORDERS_TABLE, after_id, min(limit, MAX_ORDER_PAGE_SIZE))
+
+    @staff_only
+    def get_completed_orders_page(self, session: Session, after_id: int = 0, limit: int = ORDER_PAGE_SIZE) -> dict:
+        """Returns up to limit completed orders with order_id > after_id."""
+        return self._order_page(COMPLETED_ORDERS_TABLE, after_id, min(limit, MAX_ORDER_PAGE_SIZE))
+
+    @staff_only
+    def stream_orders(self, session: Session, completed: bool = False, after_id: int = 0, page_size: int = ORDER_PAGE_SIZE):
+        """
+        Returns a generator of order pages, walking the table by order_id so
+        only one page is held in memory at a time. The last page has more=False.
+        """
+        table = COMPLETED_ORDERS_TABLE if completed else PENDING_ORDERS_TABLE
+        page_size = min(page_size, MAX_ORDER_PAGE_SIZE)
+
+        def pages():
+            cursor = after_id
+            while True:
+                page = self._order_page(table, cursor, page_size)
+                yield page
+                if not page["more"]:
+                    return
+                cursor = page["next_after_id"]
+        return pages()
+
+    @staff_only
+    def export_completed_orders(self, session: Session, fmt: str = "csv", after_seq: int = 0, since: str = None,
+                                batch_size: int = ORDER_EXPORT_BATCH_SIZE):
+        """
+        Returns a generator of export chunks for the completed orders still in
+        the database that were completed after watermark after_seq and, when
+        since is given, after it (a completed_at timestamp, or a YYYY-MM-DD
+        date meaning that whole day on). Orders are exported in completion
+        order, and each chunk carries the watermark to pass as after_seq next
+        time; the last chunk has more=False.
+        """
+        if fmt not in ORDER_FORMATS:
+            return {"error": f"format must be one of {', '.join(ORDER_FORMATS)}"}
+        if since is not None:
+            try:
+                parse_day(since[:10] if isinstance(since, str) else since)
+            except ValueError:
+                return {"error": "since must be a YYYY-MM-DD date or completed_at timestamp"}
+        batch_size = max(1, min(batch_size, MAX_ORDER_PAGE_SIZE))
+        where, params = "WHERE completion_seq > ?", (after_seq,)
+        if since is not None:
+            where, params = where + " AND completed_at > ?", params + (since,)
+        batches = self.db.fetch_batches(
+            f"""
+            SELECT order_id, completed_at, order_details, completion_seq FROM {COMPLETED_ORDERS_TABLE}
+            {where} ORDER BY completion_seq
+            """,
+            params, batch_size
         )
-        return "Menu item added"
+
+        def chunks():
+            watermark, exported = after_seq, 0
+            try:
+                rows = next(batches, [])
+                while True:
+                    # Reading one batch ahead tells us whether this chunk is the last
+                    following = next(batches, None)
+                    orders = [
+                        {
+                            "order_id": row[0],
+                            "completed_at": row[1],
+                            "order_details": compact_order_details(serialization.loads(row[2]))
+                        }
+                        for row in rows
+                    ]
+                    if rows:
+                        watermark = rows[-1][3]
+                    yield {
+                        "format": fmt,
+                        "data": format_orders(orders, fmt, header=exported == 0),
+                        "exported": exported + len(rows),
+                        "watermark": watermark,
+                        "more": following is not None
+                    }
+                    if following is None:
+                        return
+                    exported += len(rows)
+                    rows = following
+            finally:
+                batches.close()
+
+        return chunks()
 
     @staff_only
-    def remove_menu_item(self, item_id: int):
-        self.db.execute(
-            f"DELETE FROM {MENU_TABLE} WHERE item_id = ?",
-            (item_id,)
+    def get_stats(self, session: Session) -> dict:
+        return self.stats.snapshot(self._load_menu().items)
+
+    @staff_only
+    def get_item_totals(self, session: Session, completed: bool = False, item_id: int = None) -> list:
+        """
+        Aggregates order_items inside SQLite: units and revenue per item across
+        pending (or completed) orders, optionally for a single item.
+        """
+        table = COMPLETED_ORDERS_TABLE if completed else PENDING_ORDERS_TABLE
+        where, params = ("WHERE oi.item_id = ?", (item_id,)) if item_id is not None else ("", ())
+        rows = self.db.execute(
+            f"""
+            SELECT oi.item_id, SUM(oi.quantity), SUM(oi.quantity * oi.unit_price), COUNT(*)
+            FROM {ORDER_ITEMS_TABLE} oi JOIN {table} o ON o.order_id = oi.order_id
+            {where}
+            GROUP BY oi.item_id
+            ORDER BY oi.item_id
+            """,
+            params, fetch=True
         )
+        return [
+            {"item_id": row[0], "quantity": row[1], "revenue": row[2], "orders": row[3]}
+            for row in rows
+        ]
+
+    # Every menu mutation stamps the rows it touches with the next menu version
+
+    @staff_only
+    def add_menu_item(self, session: Session, item_name: str, price: float):
+        def insert(cursor):
+            cursor.execute(
+                f"INSERT INTO {MENU_TABLE} (item_name, item_price, enabled, version) VALUES (?, ?, 1, ?)",
+                (item_name, price, self._next_menu_version(cursor))
+            )
+            self._record_change(cursor, "menu_changed", {})
+        self.db.write(insert)
+        self._invalidate_menu()
+        return "Menu item added"
+
+    @staff_only
+    def remove_menu_item(self, session: Session, item_id: int):
+        def delete(cursor):
+            # Taken before the DELETE, which may remove the row holding the newest version
+            version = self._next_menu_version(cursor)
+            cursor.execute(f"DELETE FROM {MENU_TABLE} WHERE item_id = ?", (item_id,))
+            if cursor.rowcount:
+                cursor.execute(
+                    f"INSERT OR REPLACE INTO {MENU_TOMBSTONES_TABLE} (item_id, version) VALUES (?, ?)",
+                    (item_id, version)
+                )
+                self._record_change(cursor, "menu_changed", {})
+        self.db.write(delete)
+        self._invalidate_menu()
         return "Menu item removed"
 
     @staff_only
-    def modify_menu_item(self, item_id: int, new_price: float = None, enabled: bool = None):
-        if new_price is not None:
-            self.db.execute(
-                f"UPDATE {MENU_TABLE} SET item_price = ? WHERE item_id = ?",
-                (new_price, item_id)
+    def modify_menu_item(self, session: Session, item_id: int, new_price: float = None, enabled: bool = None):
+        def update(cursor):
+            version = self._next_menu_version(cursor)
+            if new_price is not None:
+                cursor.execute(
+                    f"UPDATE {MENU_TABLE} SET item_price = ?, version = ? WHERE item_id = ?",
+                    (new_price, version, item_id)
+                )
+            if enabled is not None:
+                cursor.execute(
+                    f"UPDATE {MENU_TABLE} SET enabled = ?, version = ? WHERE item_id = ?",
+                    (int(enabled), version, item_id)
+                )
+            self._record_change(cursor, "menu_changed", {})
+        self.db.write(update)
+        self._invalidate_menu()
+        return "Menu item updated"
+
+    # Bulk menu operations: each is one write transaction built on executemany
+
+    @staff_only
+    def upsert_menu_items(self, session: Session, items: list) -> dict:
+        """
+        Inserts or updates many menu items at once. Items with an item_id are
+        written under that id; the rest update the item with the same name,
+        or are added if there is none.
+        """
+        if not isinstance(items, list):
+            return {"error": "items must be a list"}
+        try:
+            items = [normalize_menu_item(item) for item in items]
+        except ValueError as e:
+            return {"error": str(e)}
+        if not items:
+            return {"inserted": 0, "updated": 0}
+        # A later row for the same item replaces an earlier one
+        items = list({
+            item["item_id"] if item["item_id"] is not None else item["item_name"]: item for item in items
+        }.values())
+
+        def upsert(cursor):
+            version = self._next_menu_version(cursor)
+            ids_by_name, existing = {}, set()
+            for item_id, item_name in cursor.execute(f"SELECT item_id, item_name FROM {MENU_TABLE} ORDER BY item_id"):
+                ids_by_name.setdefault(item_name, item_id)
+                existing.add(item_id)
+            updates, inserts = [], []
+            for item in items:
+                item_id = item["item_id"] if item["item_id"] is not None else ids_by_name.get(item["item_name"])
+                row = (item["item_name"], item["item_price"], int(item["enabled"]), version)
+                if item_id in existing:
+                    updates.append(row + (item_id,))
+                else:
+                    inserts.append((item_id,) + row)
+            cursor.executemany(
+                f"UPDATE {MENU_TABLE} SET item_name = ?, item_price = ?, enabled = ?, version = ? WHERE item_id = ?",
+                updates
             )
-        if enabled is not None:
-            self.db.execute(
-                f"UPDATE {MENU_TABLE} SET enabled = ? WHERE item_id = ?",
-                (int(enabled), item_id)
+            cursor.executemany(
+                f"INSERT INTO {MENU_TABLE} (item_id, item_name, item_price, enabled, version) VALUES (?, ?, ?, ?, ?)",
+                inserts
             )
-        return "Menu item updated"
+            # An id brought back is no longer removed
+            cursor.executemany(
+                f"DELETE FROM {MENU_TOMBSTONES_TABLE} WHERE item_id = ?",
+                [(row[0],) for row in inserts if row[0] is not None]
+            )
+            self._record_change(cursor, "menu_changed", {})
+            return {"inserted": len(inserts), "updated": len(updates)}
+
+        try:
+            result = self.db.write(upsert)
+        except sqlite3.IntegrityError as e:
+            return {"error": f"Menu import rejected: {e}"}
+        self._invalidate_menu()
+        return result
+
+    @staff_only
+    def import_menu(self, session: Session, data: str, fmt: str = "csv") -> dict:
+        """Parses a CSV or JSON Lines menu and upserts every row in one transaction."""
+        if not isinstance(data, str):
+            return {"error": "data must be a string"}
+        try:
+            items = parse_menu(data, fmt)
+        except ValueError as e:
+            return {"error": str(e)}
+        return self.upsert_menu_items(session, items)
+
+    @staff_only
+    def set_menu_items_enabled(self, session: Session, item_ids: list, enabled: bool) -> dict:
+        """Enables or disables every item in item_ids at once, e.g. when the kitchen sells out."""
+        if not isinstance(item_ids, list) or not all(isinstance(item_id, int) for item_id in item_ids):
+            return {"error": "item_ids must be a list of integers"}
+        item_ids = list(dict.fromkeys(item_ids))
+
+        def update(cursor):
+            version = self._next_menu_version(cursor)
+            cursor.executemany(
+                f"UPDATE {MENU_TABLE} SET enabled = ?, version = ? WHERE item_id = ?",
+                [(int(bool(enabled)), version, item_id) for item_id in item_ids]
+            )
+            updated = cursor.rowcount
+            if updated:
+                self._record_change(cursor, "menu_changed", {})
+            return updated
+
+        updated = self.db.write(update) if item_ids else 0
+        self._invalidate_menu()
+        return {"enabled": bool(enabled), "updated": updated}
+
+    @staff_only
+    def export_menu(self, session: Session, fmt: str = "csv", page_size: int = MENU_EXPORT_PAGE_SIZE):
+        """
+        Returns a generator of export chunks, walking the menu table by item_id
+        so only one page is held in memory. The last chunk has more=False.
+        """
+        if fmt not in MENU_FORMATS:
+            return {"error": f"format must be one of {', '.join(MENU_FORMATS)}"}
+        page_size = max(1, min(page_size, MAX_ORDER_PAGE_SIZE))
 
+        def chunks():
+            after_id = 0
+            while True:
+                rows = self.db.execute(
+                    f"""
+                    SELECT item_id, item_name, item_price, enabled FROM {MENU_TABLE}
+                    WHERE item_id > ? ORDER BY item_id LIMIT ?
+                    """,
+                    (after_id, page_size), fetch=True
+                )
+                items = [
+                    {"item_id": row[0], "item_name": row[1], "item_price": row[2], "enabled": bool(row[3])}
+                    for row in rows
+                ]
+                more = len(rows) == page_size
+                yield {"format": fmt, "data": format_menu(items, fmt, header=after_id == 0), "more": more}
+                if not more:
+                    return
+                after_id = rows[-1][0]
 
+        return chunks()
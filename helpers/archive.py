@@ -0,0 +1,70 @@
+"""
+Day-partitioned archive of completed orders.
+
+Each day's completed orders live in one gzip-compressed JSON Lines file,
+completed-YYYY-MM-DD.jsonl.gz, in a directory next to the database. A
+date-range read opens only the files for the days it covers, so archived
+history costs nothing until someone asks for it.
+"""
+import datetime
+import gzip
+import json
+import os
+from .constants import *
+
+def parse_day(day) -> datetime.date:
+    """Returns the date for a YYYY-MM-DD string; raises ValueError for anything else."""
+    if not isinstance(day, str):
+        raise ValueError(f"Invalid date: {day!r}")
+    return datetime.date.fromisoformat(day)
+
+class OrderArchive:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, day: str) -> str:
+        return os.path.join(self.directory, f"{ARCHIVE_FILE_PREFIX}{day}{ARCHIVE_FILE_SUFFIX}")
+
+    def days(self) -> list:
+        """Returns the days that have a partition, oldest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            name[len(ARCHIVE_FILE_PREFIX):-len(ARCHIVE_FILE_SUFFIX)]
+            for name in names
+            if name.startswith(ARCHIVE_FILE_PREFIX) and name.endswith(ARCHIVE_FILE_SUFFIX)
+        )
+
+    def read(self, day: str) -> list:
+        try:
+            with gzip.open(self.path(day), "rt", encoding=FORMAT) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def write(self, day: str, orders: list):
+        """
+        Adds orders to the day's partition. Orders already in it are kept
+        once, so re-archiving after an interrupted run is harmless. The file
+        is replaced atomically and synced before this returns.
+        """
+        merged = {order["order_id"]: order for order in self.read(day)}
+        merged.update((order["order_id"], order) for order in orders)
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(day)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=ARCHIVE_COMPRESSION_LEVEL) as f:
+                for order_id in sorted(merged):
+                    f.write(json.dumps(merged[order_id]).encode(FORMAT) + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temp_path, path)
+
+    def query(self, start_day: str, end_day: str):
+        """Yields the archived orders completed from start_day to end_day inclusive."""
+        for day in self.days():
+            if start_day <= day <= end_day:
+                yield from self.read(day)
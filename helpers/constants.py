@@ -1,13 +1,86 @@
 # Database Constants
 DB_PATH = "backend/database.sqlite"
+DB_PATH_ENV = "SMARTSERVE_DB"
 USER_TABLE = "accounts"
 PENDING_ORDERS_TABLE = "pending_orders"
 COMPLETED_ORDERS_TABLE = "completed_orders"
 MENU_TABLE = "menu_items"
+MENU_TOMBSTONES_TABLE = "menu_tombstones"
+CHANGES_TABLE = "changes"
+ORDER_ITEMS_TABLE = "order_items"
+SETTINGS_TABLE = "settings"
+MENU_EPOCH_KEY = "menu_epoch"
+COMPLETION_SEQ_KEY = "completion_seq"
+ORDER_PAGE_SIZE = 50
+MAX_ORDER_PAGE_SIZE = 500
+MENU_EXPORT_PAGE_SIZE = 200
+ORDER_EXPORT_BATCH_SIZE = 500
+SQL_IN_CHUNK_SIZE = 500
+PASSWORD_HASH_ITERATIONS = 200_000
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+ARCHIVE_DIR_NAME = "archive"
+ARCHIVE_FILE_PREFIX = "completed-"
+ARCHIVE_FILE_SUFFIX = ".jsonl.gz"
+ARCHIVE_COMPRESSION_LEVEL = 6
+ARCHIVE_RETENTION_DAYS = 30
+DB_BUSY_TIMEOUT = 5.0
+DB_SYNCHRONOUS = "NORMAL"
+DB_WRITER_SYNCHRONOUS = "FULL"
+DB_STATEMENT_CACHE_SIZE = 256
+GROUP_COMMIT_MAX_BATCH = 256
+GROUP_COMMIT_WINDOW = 0.002
 
 
 # Server-Client Constants
 PORT = 5050
 HEADER_SIZE = 64
+MAX_FRAME_SIZE = 16 * 1024 * 1024
 FORMAT = 'utf-8'
-DISCONNECT_MESSAGE = "!DISCONNECT"
\ No newline at end of file
+DISCONNECT_MESSAGE = "!DISCONNECT"
+MENU_REQUEST = "Get Menu"
+JSON_BACKEND = "auto"
+PROTOCOL_VERSION = 2
+PUSH_REQUEST_ID = 0
+MAX_PIPELINED_REQUESTS = 32
+PUSH_QUEUE_SIZE = 1000
+PUSH_BUFFER_LIMIT = 1024 * 1024
+MENU_CACHE_FILE = ".smartserve_menu.json"
+COMPRESSION = "zlib"
+COMPRESSED_FLAG = "z"
+COMPRESSION_THRESHOLD = 1024
+COMPRESSION_LEVEL = 6
+
+
+# Async Server Constants
+DB_WORKERS = 8
+LISTEN_BACKLOG = 1024
+
+
+# Admission Control Constants
+MAX_CONNECTIONS = 1024
+MAX_QUEUED_REQUESTS = 256
+QUEUE_TIMEOUT = 0.5
+IDLE_TIMEOUT = 300.0
+READ_TIMEOUT = 10.0
+RETRY_AFTER = 1.0
+DRAIN_TIMEOUT = 10.0
+BUSY_RETRIES = 3
+
+
+# Worker Process Constants
+CHANGE_POLL_INTERVAL = 0.05
+CHANGE_LOG_RETENTION = 60.0
+
+
+# Session Token Constants
+SECRET_KEY_ENV = "SMARTSERVE_SECRET"
+TOKEN_TTL = 8 * 60 * 60
+TOKEN_CACHE_SIZE = 10_000
+TOKEN_FILE = ".smartserve_token"
+
+
+# Instrumentation Constants
+LOG_LEVEL = "INFO"
+HISTOGRAM_MIN_BOUND = 0.00005  # 50µs; each bucket doubles the one before
+HISTOGRAM_BUCKETS = 18
+METRICS_DUMP_INTERVAL = 10.0
@@ -0,0 +1,183 @@
+"""
+Lightweight instrumentation for the server hot path.
+
+metrics collects per-action latency histograms, database time, bytes on the
+wire and connection counts. Recording is a couple of integer updates under a
+lock, and the histograms use fixed buckets, so memory stays constant however
+many requests are served.
+
+logger is the server's leveled logger. setup_logging() routes it through a
+queue drained by a background thread, so a log call only enqueues a record;
+below the configured level a call returns before any formatting is done.
+"""
+import bisect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from .constants import *
+
+logger = logging.getLogger("smartserve")
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "OFF")
+
+def setup_logging(level: str = LOG_LEVEL, prefix: str = ""):
+    """
+    Sets the log level and starts the background thread that writes records
+    to stdout, each preceded by prefix. Returns the QueueListener, or None
+    when logging is OFF.
+    """
+    logger.handlers.clear()
+    logger.propagate = False
+    if level == "OFF":
+        logger.setLevel(logging.CRITICAL + 1)
+        logger.disabled = True
+        return None
+    logger.disabled = False
+    logger.setLevel(level)
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter(prefix.replace("%", "%%") + "%(message)s"))
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    return listener
+
+class Histogram:
+    """
+    Latency histogram over fixed, exponentially growing buckets (seconds).
+    Percentiles are reported as the upper bound of the bucket they fall in,
+    capped at the largest sample seen.
+    """
+    BOUNDS = tuple(HISTOGRAM_MIN_BOUND * 2 ** i for i in range(HISTOGRAM_BUCKETS))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(self.BOUNDS[index], self.max) if index < len(self.BOUNDS) else self.max
+        return 0.0
+
+    def snapshot(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3),
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p95_ms": round(self.percentile(0.95) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+class Metrics:
+    """Process-wide counters and histograms; every method is thread-safe."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.actions = {}
+        self.errors = {}
+        self.db_queries = Histogram()
+        self.db_writes = Histogram()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.active_connections = 0
+        self.total_connections = 0
+        self.rejections = {}
+        self._dump_thread = None
+        self._dump_stop = threading.Event()
+
+    def record_action(self, name: str, seconds: float, failed: bool = False):
+        with self._lock:
+            histogram = self.actions.get(name)
+            if histogram is None:
+                histogram = self.actions[name] = Histogram()
+            histogram.record(seconds)
+            if failed:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def record_query(self, seconds: float):
+        with self._lock:
+            self.db_queries.record(seconds)
+
+    def record_write(self, seconds: float):
+        with self._lock:
+            self.db_writes.record(seconds)
+
+    def add_bytes(self, received: int = 0, sent: int = 0):
+        with self._lock:
+            self.bytes_in += received
+            self.bytes_out += sent
+
+    def connection_opened(self):
+        with self._lock:
+            self.active_connections += 1
+            self.total_connections += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.active_connections -= 1
+
+    def record_rejection(self, kind: str):
+        """Counts a connection or request turned away because the server was at capacity."""
+        with self._lock:
+            self.rejections[kind] = self.rejections.get(kind, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "uptime": round(time.time() - self.started, 3),
+                "connections": {"active": self.active_connections, "total": self.total_connections},
+                "bytes": {"in": self.bytes_in, "out": self.bytes_out},
+                "rejections": dict(self.rejections),
+                "actions": {
+                    name: dict(histogram.snapshot(), errors=self.errors.get(name, 0))
+                    for name, histogram in sorted(self.actions.items())
+                },
+                "db": {"queries": self.db_queries.snapshot(), "writes": self.db_writes.snapshot()}
+            }
+
+    def start_dump(self, path: str, interval: float = METRICS_DUMP_INTERVAL):
+        """Rewrites path with a snapshot every interval seconds until stop_dump()."""
+        def run():
+            while not self._dump_stop.wait(interval):
+                self.dump(path)
+
+        self._dump_stop.clear()
+        self._dump_thread = threading.Thread(target=run, name="metrics-dump", daemon=True)
+        self._dump_thread.start()
+
+    def dump(self, path: str):
+        try:
+            with open(path, "w") as f:
+                json.dump(self.snapshot(), f, indent=2)
+        except OSError as e:
+            logger.warning(f"[METRICS] Could not write {path}: {e}")
+
+    def stop_dump(self):
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
+
+metrics = Metrics()
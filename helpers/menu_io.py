@@ -0,0 +1,78 @@
+"""
+CSV and JSON Lines formats for bulk menu import and export.
+
+Both formats use the columns item_id, item_name, item_price and enabled. On
+import, item_id and enabled may be left out: rows without an id are matched
+to existing items by name, and items are enabled unless the row says not.
+"""
+import csv
+import io
+import json
+
+MENU_COLUMNS = ("item_id", "item_name", "item_price", "enabled")
+MENU_FORMATS = ("csv", "jsonl")
+
+_TRUE = {"1", "true", "yes", "y"}
+_FALSE = {"0", "false", "no", "n"}
+
+def normalize_menu_item(item) -> dict:
+    """Returns a validated copy of one menu item; raises ValueError if it is malformed."""
+    if not isinstance(item, dict):
+        raise ValueError("each item must be an object")
+    item_id = item.get("item_id")
+    if item_id in ("", None):
+        item_id = None
+    elif isinstance(item_id, str) and item_id.strip().isdigit():
+        item_id = int(item_id)
+    elif not isinstance(item_id, int) or isinstance(item_id, bool):
+        raise ValueError(f"invalid item_id {item_id!r}")
+    name = item.get("item_name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("item_name is required")
+    try:
+        price = float(item.get("item_price"))
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid item_price {item.get('item_price')!r}")
+    if price < 0:
+        raise ValueError("item_price must not be negative")
+    enabled = item.get("enabled", True)
+    if isinstance(enabled, str):
+        value = enabled.strip().lower()
+        if value in _FALSE:
+            enabled = False
+        elif value in _TRUE or not value:
+            enabled = True
+        else:
+            raise ValueError(f"invalid enabled value {enabled!r}")
+    elif not isinstance(enabled, (bool, int)):
+        raise ValueError(f"invalid enabled value {enabled!r}")
+    return {"item_id": item_id, "item_name": name.strip(), "item_price": price, "enabled": bool(enabled)}
+
+def parse_menu(text: str, fmt: str) -> list:
+    """Parses an exported or hand-written menu; errors name the offending line."""
+    if fmt not in MENU_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(MENU_FORMATS)}")
+    if fmt == "csv":
+        rows = enumerate(csv.DictReader(io.StringIO(text)), start=2)
+    else:
+        rows = ((number, line) for number, line in enumerate(text.splitlines(), start=1) if line.strip())
+    items = []
+    for number, row in rows:
+        try:
+            if fmt == "jsonl":
+                row = json.loads(row)
+            items.append(normalize_menu_item(row))
+        except ValueError as e:
+            raise ValueError(f"line {number}: {e}")
+    return items
+
+def format_menu(items: list, fmt: str, header: bool = False) -> str:
+    """Renders menu items in fmt; header adds the CSV column row."""
+    if fmt == "jsonl":
+        return "".join(json.dumps({column: item[column] for column in MENU_COLUMNS}) + "\n" for item in items)
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    if header:
+        writer.writerow(MENU_COLUMNS)
+    writer.writerows([item[column] for column in MENU_COLUMNS] for item in items)
+    return output.getvalue()
@@ -0,0 +1,29 @@
+"""
+CSV and JSON Lines formats for exporting completed orders.
+
+JSON Lines has one object per order, with its order_details as stored. CSV
+is flattened for spreadsheets: one row per order line, repeating order_id
+and completed_at, with the columns in ORDER_CSV_COLUMNS.
+"""
+import csv
+import io
+import json
+
+ORDER_FORMATS = ("csv", "jsonl")
+ORDER_CSV_COLUMNS = ("order_id", "completed_at", "item_id", "item_name", "item_price", "quantity")
+
+def format_orders(orders: list, fmt: str, header: bool = False) -> str:
+    """Renders orders (order_id, completed_at, order_details) in fmt; header adds the CSV column row."""
+    if fmt == "jsonl":
+        return "".join(json.dumps(order) + "\n" for order in orders)
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    if header:
+        writer.writerow(ORDER_CSV_COLUMNS)
+    writer.writerows(
+        [order["order_id"], order["completed_at"],
+         line["item_id"], line["item_name"], line["item_price"], line["quantity"]]
+        for order in orders
+        for line in order["order_details"]
+    )
+    return output.getvalue()
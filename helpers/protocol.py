@@ -0,0 +1,148 @@
+"""
+Wire framing shared by the server and the CLI.
+
+Every frame is a HEADER_SIZE-byte ASCII header, padded with spaces, followed
+by the payload. Protocol 1 (the original) puts only the payload length in the
+header. Protocol 2 puts "<length> <request_id>" there, so a client can keep
+several requests in flight on one connection and match each reply to its
+request; frames the server pushes on its own carry PUSH_REQUEST_ID.
+
+Connections start on protocol 1. A client upgrades by sending a protocol 1
+hello frame ({"action": "hello", "protocol": 2}); servers that understand it
+answer {"protocol": 2} and from then on reply in whichever header format
+each request used.
+
+A protocol 2 hello may also ask for "compression": "zlib". Once the server
+agrees, it zlib-compresses protocol 2 frames whose payload is larger than its
+threshold and marks them with a third header field, "<length> <request_id> z".
+read_frame() decompresses flagged frames, so callers only see plain payloads.
+"""
+import asyncio
+import zlib
+from .constants import *
+
+class ProtocolError(Exception):
+    pass
+
+def encode_frame(payload: bytes, request_id: int = None, compress_above: int = None,
+                 level: int = COMPRESSION_LEVEL) -> bytes:
+    """
+    Prefixes payload with a protocol 1 header, or protocol 2 if request_id is
+    given. With compress_above set, protocol 2 payloads longer than it are
+    zlib-compressed at level and flagged as such in the header.
+    """
+    if request_id is None:
+        header = str(len(payload))
+    elif compress_above is not None and len(payload) > compress_above:
+        payload = zlib.compress(payload, level)
+        header = f"{len(payload)} {request_id} {COMPRESSED_FLAG}"
+    else:
+        header = f"{len(payload)} {request_id}"
+    header = header.encode(FORMAT)
+    if len(header) > HEADER_SIZE:
+        raise ProtocolError("Frame header too long")
+    return header + b' ' * (HEADER_SIZE - len(header)) + payload
+
+def parse_header(header: bytes) -> tuple:
+    """
+    Returns (payload_length, request_id, compressed); request_id is None for
+    protocol 1 headers.
+    """
+    try:
+        fields = header.decode(FORMAT).split()
+        if not 1 <= len(fields) <= 3 or (len(fields) == 3 and fields[2] != COMPRESSED_FLAG):
+            raise ValueError
+        length = int(fields[0])
+        request_id = int(fields[1]) if len(fields) >= 2 else None
+    except (UnicodeDecodeError, ValueError):
+        raise ProtocolError(f"Malformed frame header: {header!r}")
+    if length < 0:
+        raise ProtocolError(f"Malformed frame header: {header!r}")
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return length, request_id, len(fields) == 3
+
+def decompress_payload(payload: bytes) -> bytes:
+    """Inflates a compressed payload, refusing any that would grow past MAX_FRAME_SIZE."""
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(payload, MAX_FRAME_SIZE)
+    except zlib.error as e:
+        raise ProtocolError(f"Corrupt compressed frame: {e}")
+    if decompressor.unconsumed_tail:
+        raise ProtocolError(f"Compressed frame inflates past the {MAX_FRAME_SIZE} byte limit")
+    if not decompressor.eof:
+        raise ProtocolError("Corrupt compressed frame: truncated stream")
+    return data
+
+def _fill(sock, view: memoryview, received: int = 0):
+    """Reads into view until it is full, given that received bytes are already there."""
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Connection closed mid-frame")
+        received += count
+
+def recv_exact(sock, size: int) -> bytes:
+    """
+    Reads exactly size bytes, looping over short reads. Returns b"" if the
+    peer closed before sending anything, and raises ConnectionError if it
+    closed partway through.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = sock.recv_into(view) if size else 0
+    if size and received == 0:
+        return b""
+    _fill(sock, view, received)
+    return bytes(buffer)
+
+def read_frame(sock, read_timeout: float = None):
+    """
+    Returns (request_id, payload) for the next frame, or None once the peer
+    has closed. Waiting for a frame to start is bounded by the socket's own
+    timeout, and a timeout there consumes nothing; once it has started, the
+    rest of the frame must arrive within read_timeout.
+    """
+    header = bytearray(HEADER_SIZE)
+    view = memoryview(header)
+    received = sock.recv_into(view)
+    if received == 0:
+        return None
+    idle_timeout = sock.gettimeout()
+    if read_timeout is not None:
+        sock.settimeout(read_timeout)
+    try:
+        _fill(sock, view, received)
+        length, request_id, compressed = parse_header(bytes(header))
+        payload = bytearray(length)
+        _fill(sock, memoryview(payload))
+    finally:
+        if read_timeout is not None:
+            sock.settimeout(idle_timeout)
+    payload = bytes(payload)
+    if compressed:
+        payload = decompress_payload(payload)
+    return request_id, payload
+
+async def read_frame_async(reader: asyncio.StreamReader, idle_timeout: float = None, read_timeout: float = None):
+    """
+    asyncio counterpart of read_frame(). Raises TimeoutError if no header
+    arrives within idle_timeout, leaving the stream untouched (readexactly
+    keeps partial data buffered when cancelled), or if the payload does not
+    arrive within read_timeout.
+    """
+    try:
+        header = await asyncio.wait_for(reader.readexactly(HEADER_SIZE), idle_timeout)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionError("Connection closed mid-frame")
+    length, request_id, compressed = parse_header(header)
+    try:
+        payload = await asyncio.wait_for(reader.readexactly(length), read_timeout)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Connection closed mid-frame")
+    if compressed:
+        payload = decompress_payload(payload)
+    return request_id, payload
@@ -0,0 +1,38 @@
+"""
+JSON backend used on the hot path. orjson is used when it is installed and
+the standard library otherwise; set_backend() picks one explicitly.
+
+dumps() always returns UTF-8 bytes ready to be framed, and every decode error
+is a ValueError whichever backend raised it.
+"""
+import json
+from .constants import *
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ("auto", "json", "orjson")
+
+def _json_dumps(obj) -> bytes:
+    return json.dumps(obj).encode(FORMAT)
+
+dumps = _json_dumps
+loads = json.loads
+backend = "json"
+
+def set_backend(name: str = "auto") -> str:
+    """Selects the JSON backend and returns the name of the one in use."""
+    global dumps, loads, backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {name}")
+    if name == "orjson" and orjson is None:
+        raise ValueError("orjson is not installed")
+    if name != "json" and orjson is not None:
+        dumps, loads, backend = orjson.dumps, orjson.loads, "orjson"
+    else:
+        dumps, loads, backend = _json_dumps, json.loads, "json"
+    return backend
+
+set_backend(JSON_BACKEND)